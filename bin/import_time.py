@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import os,sys
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import argparse
+import subprocess
+import time
+
+# modules a headless rollout worker imports, and heavy optional dependencies they should not pull in
+MODULES = ['multiagent.core', 'multiagent.environment', 'multiagent.policy', 'multiagent.scenarios.scripted_prey_tag']
+HEAVY = ['seaborn', 'matplotlib', 'pyglet', 'scipy']
+
+# run in a fresh interpreter: import the module and report the time spent and the heavy modules loaded
+SCRIPT = """
+import sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+print(elapsed, ' '.join(name for name in %r if name in sys.modules))
+"""
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the import of multiagent modules in fresh interpreters.')
+    parser.add_argument('-n', '--repeats', type=int, default=5, help='Number of interpreters per module.')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='Modules to import.')
+    args = parser.parse_args()
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    failed = False
+    for module in args.modules:
+        times = []
+        for _ in range(args.repeats):
+            start = time.time()
+            process = subprocess.run([sys.executable, '-c', SCRIPT % (module, HEAVY)], env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if process.returncode != 0:
+                break
+            output = process.stdout.decode().split()
+            times.append((float(output[0]), time.time() - start))
+            heavy = output[1:]
+        if not times:
+            # e.g. an import needing a display
+            print('%-45s import failed: %s' % (module, process.stderr.decode().strip().splitlines()[-1]))
+            failed = True
+            continue
+        import_time = min(t[0] for t in times)
+        startup_time = min(t[1] for t in times)
+        print('%-45s import %7.1f ms  interpreter %7.1f ms  heavy modules: %s' %
+              (module, 1000 * import_time, 1000 * startup_time, ' '.join(heavy) or '-'))
+        failed |= bool(heavy)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+import os,sys
+sys.path.insert(1, os.path.join(sys.path[0], '..'))
+import argparse
+import time
+
+import numpy as np
+
+from multiagent.core import BatchWorld
+import multiagent.scenarios as scenarios
+
+# roll out a scenario's worlds with their scripted agents (other agents hold a zero action), e.g. to generate
+# baseline trajectories, or to check that the physics still reproduces trajectories saved earlier
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Roll out scripted agents without the environment.')
+    parser.add_argument('-s', '--scenario', default='scripted_prey_tag.py', help='Path of the scenario Python script.')
+    parser.add_argument('-T', '--steps', type=int, default=100, help='Number of steps.')
+    parser.add_argument('-n', '--worlds', type=int, default=1, help='Number of worlds stepped together.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the initial states and noise.')
+    parser.add_argument('--save', help='Save the trajectories to this .npz file.')
+    parser.add_argument('--check', help='Compare the trajectories to those saved in this .npz file.')
+    args = parser.parse_args()
+
+    # create and reset the worlds
+    scenario = scenarios.load(args.scenario).Scenario()
+    np.random.seed(args.seed)
+    worlds = []
+    for b in range(args.worlds):
+        world = scenario.make_world()
+        scenario.reset_world(world)
+        world.seed(args.seed + b)
+        worlds.append(world)
+    reward_callback = getattr(scenario, 'reward_all', None)
+
+    start = time.time()
+    if args.worlds == 1:
+        trajectory = worlds[0].rollout(args.steps, reward_callback)
+    else:
+        trajectory = BatchWorld(worlds).rollout(args.steps, reward_callback)
+    elapsed = time.time() - start
+    print('%d steps of %d world(s): %.1f ms (%.1f us per step)' %
+          (args.steps, args.worlds, 1000 * elapsed, 1e6 * elapsed / args.steps))
+
+    if args.save:
+        np.savez(args.save, **trajectory)
+    if args.check:
+        expected = np.load(args.check)
+        errors = {name: np.max(np.abs(trajectory[name] - expected[name])) for name in expected.files}
+        print('max differences: ' + ', '.join('%s %g' % item for item in sorted(errors.items())))
+        if not all(np.allclose(trajectory[name], expected[name], rtol=1e-7, atol=1e-9) for name in expected.files):
+            sys.exit(1)
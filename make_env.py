@@ -12,7 +12,7 @@ of size (env.world.dim_p + env.world.dim_c, 1). Physical actions precede
 communication actions in this array. See environment.py for more details.
 """
 
-def make_env(scenario_name, benchmark=False):
+def make_env(scenario_name, benchmark=False, preallocated=False):
     '''
     Creates a MultiAgentEnv object as env. This can be used similar to a gym
     environment by calling env.reset() and env.step().
@@ -23,6 +23,9 @@ def make_env(scenario_name, benchmark=False):
                             (without the .py extension)
         benchmark       :   whether you want to produce benchmarking data
                             (usually only done during evaluation)
+        preallocated    :   whether step() and reset() return views of
+                            preallocated arrays owned by the env instead
+                            of new lists (see environment.py)
 
     Some useful env properties (see environment.py):
         .observation_space  :   Returns the observation space for each agent
@@ -43,11 +46,17 @@ def make_env(scenario_name, benchmark=False):
                             reward_callback=scenario.reward,
                             observation_callback=scenario.observation,
                             post_step_callback=scenario.post_step,
-                            info_callback=scenario.benchmark_data)
+                            info_callback=scenario.benchmark_data,
+                            preallocated=preallocated,
+                            reward_all_callback=getattr(scenario, 'reward_all', None),
+                            observation_all_callback=getattr(scenario, 'observation_all', None))
     else:
         env = MultiAgentEnv(world,
                             reset_callback=scenario.reset_world,
                             reward_callback=scenario.reward,
                             observation_callback=scenario.observation,
-                            post_step_callback=scenario.post_step)
+                            post_step_callback=scenario.post_step,
+                            preallocated=preallocated,
+                            reward_all_callback=getattr(scenario, 'reward_all', None),
+                            observation_all_callback=getattr(scenario, 'observation_all', None))
     return env
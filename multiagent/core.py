@@ -1,28 +1,196 @@
+import math
 import numpy as np
-import seaborn as sns
+
+# anchor colors of the built-in agent palettes (the same as seaborn's "OrRd_d" and "GnBu_d" palettes,
+# so seaborn is not needed unless another palette is asked for)
+AGENT_PALETTES = {
+    'OrRd_d': [(0.9921568627450981, 0.7660130718954248, 0.5516339869281046),
+               (0.9058823529411765, 0.32679738562091504, 0.22875816993464054), (0.2, 0.2, 0.2)],
+    'GnBu_d': [(0.7058823529411765, 0.8849673202614379, 0.7307189542483661),
+               (0.2601307189542484, 0.6509803921568628, 0.7999999999999999), (0.2, 0.2, 0.2)],
+}
+
+# n colors of the named palette: built-in palettes are evenly spaced along the linear blend of their
+# anchor colors (endpoints excluded), looked up in a 256-entry table like matplotlib colormaps;
+# other palette names are passed to seaborn
+def color_palette(name, n_colors):
+    if name not in AGENT_PALETTES:
+        import seaborn as sns
+        return sns.color_palette(name, n_colors)
+    anchors = np.array(AGENT_PALETTES[name])
+    table_x = np.linspace(0, 1, 256)
+    anchors_x = np.linspace(0, 1, len(anchors))
+    table = np.stack([np.interp(table_x, anchors_x, anchors[:, k]) for k in range(3)], axis=1)
+    x = np.linspace(0, 1, n_colors + 2)[1:-1]
+    return [tuple(color) for color in table[np.clip((x * 256).astype(int), 0, 255)].tolist()]
+
+# copy of a value saved in a world state snapshot: arrays and containers are copied, other objects (e.g.
+# entities referenced as goals) are kept as they are
+def _copy_state_value(value):
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, (dict, list, set)):
+        return type(value)(value)
+    return value
 
 # physical/external base state of all entites
 class EntityState(object):
     def __init__(self):
+        # world holding the state arrays and row of this entity in them (None until bound)
+        self._world = None
+        self._index = None
         # physical position
-        self.p_pos = None
+        self._p_pos = None
         # physical velocity
-        self.p_vel = None
+        self._p_vel = None
+        # world arrays the bound p_pos / p_vel views were taken from
+        self._p_pos_base = None
+        self._p_vel_base = None
+
+    # once bound to a world, p_pos and p_vel are views into the world's (n_entities, dim_p) arrays
+    # and assigning to them writes into those arrays (see World.p_pos for in-place writes); the
+    # views are kept until the world replaces its arrays
+    @property
+    def p_pos(self):
+        world = self._world
+        if world is None:
+            return self._p_pos
+        if self._p_pos_base is not world._p_pos:
+            self._p_pos_base, self._p_pos = world._p_pos, world._p_pos[self._index]
+        return self._p_pos
+
+    @p_pos.setter
+    def p_pos(self, value):
+        if self._world is None:
+            self._p_pos = value
+        else:
+            self._world._p_pos[self._index] = value
+            self._world._state_version += 1
+
+    @property
+    def p_vel(self):
+        world = self._world
+        if world is None:
+            return self._p_vel
+        if self._p_vel_base is not world._p_vel:
+            self._p_vel_base, self._p_vel = world._p_vel, world._p_vel[self._index]
+        return self._p_vel
+
+    @p_vel.setter
+    def p_vel(self, value):
+        if self._world is None:
+            self._p_vel = value
+        else:
+            self._world._p_vel[self._index] = value
+
+    # copies and pickles of a bound state take their views again from the copied world arrays
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._world is not None:
+            state.update(_p_pos=None, _p_vel=None, _p_pos_base=None, _p_vel_base=None)
+        return state
+
+    def bind(self, world, index):
+        # copy the current state in the world arrays and read/write it from there from now on
+        p_pos, p_vel = self.p_pos, self.p_vel
+        self._world, self._index = world, index
+        self._p_pos_base, self._p_vel_base = None, None
+        if p_pos is not None:
+            world._p_pos[index] = p_pos
+        if p_vel is not None:
+            world._p_vel[index] = p_vel
+
+    def unbind(self):
+        # take back a private copy of the state (e.g. when the entity is removed from the world)
+        if self._world is not None:
+            self._p_pos = np.copy(self.p_pos)
+            self._p_vel = np.copy(self.p_vel)
+            self._world, self._index = None, None
+            self._p_pos_base, self._p_vel_base = None, None
 
 # state of agents (including communication and internal/mental state)
 class AgentState(EntityState):
     def __init__(self):
         super(AgentState, self).__init__()
         # communication utterance
-        self.c = None
+        self._c = None
+
+    # once bound to a world, c is a view into the world's (n_agents, dim_c) communication state array
+    @property
+    def c(self):
+        if self._world is None:
+            return self._c
+        return self._world._comm[self._index]
+
+    @c.setter
+    def c(self, value):
+        if self._world is None:
+            self._c = value
+        else:
+            self._world._comm[self._index] = value
+
+    def bind(self, world, index):
+        c = self.c
+        super(AgentState, self).bind(world, index)
+        world._comm[index] = 0.0 if c is None else c
+
+    def unbind(self):
+        if self._world is not None:
+            self._c = np.copy(self.c)
+        super(AgentState, self).unbind()
 
 # action of the agent
 class Action(object):
     def __init__(self):
+        # world holding the action arrays and row of this agent in them (None until bound)
+        self._world = None
+        self._index = None
         # physical action
-        self.u = None
+        self._u = None
         # communication action
-        self.c = None
+        self._c = None
+
+    # once the agent is bound to a world, u and c are views into the world's (n_agents, dim_p) and
+    # (n_agents, dim_c) action arrays and assigning to them writes into those arrays
+    @property
+    def u(self):
+        if self._world is None:
+            return self._u
+        return self._world._action_u[self._index]
+
+    @u.setter
+    def u(self, value):
+        if self._world is None:
+            self._u = value
+        else:
+            self._world._action_u[self._index] = value
+
+    @property
+    def c(self):
+        if self._world is None:
+            return self._c
+        return self._world._action_c[self._index]
+
+    @c.setter
+    def c(self, value):
+        if self._world is None:
+            self._c = value
+        else:
+            self._world._action_c[self._index] = value
+
+    def bind(self, world, index):
+        # copy the current action in the world arrays (unset actions are zero) and read/write it
+        # from there from now on
+        u, c = self.u, self.c
+        self._world, self._index = world, index
+        world._action_u[index] = 0.0 if u is None else u
+        world._action_c[index] = 0.0 if c is None else c
+
+    def unbind(self):
+        if self._world is not None:
+            self._u = np.copy(self.u)
+            self._c = np.copy(self.c)
+            self._world, self._index = None, None
 
 class Wall(object):
     def __init__(self, orient='H', axis_pos=0.0, endpoints=(-1, 1), width=0.1,
@@ -97,9 +265,18 @@ class ConnectionLine(object):
             self.entity2.color = np.array([0., 0., 0.])
             return False
 
+# entity attributes mirrored in the world's property arrays
+PHYSICAL_PROPERTIES = frozenset(['size', 'movable', 'collide', 'ghost', 'initial_mass', 'damping',
+                                 'max_speed', 'accel', 'silent', 'u_noise', 'c_noise'])
+
+# agent attributes that decide which role lists of the world it belongs to
+ROLE_PROPERTIES = frozenset(['action_callback', 'adversary'])
+
 # properties and state of physical world entity
 class Entity(object):
     def __init__(self):
+        # world this entity is bound to (set by the world itself)
+        self._world = None
         # index among all entities (important to set for distance caching)
         self.i = 0
         # name 
@@ -131,6 +308,21 @@ class Entity(object):
     def mass(self):
         return self.initial_mass
 
+    def __setattr__(self, name, value):
+        if name == 'action' and self._world is not None:
+            # new actions (e.g. returned by action callbacks) are written into the world action arrays
+            previous = self.__dict__.get('action')
+            if previous is not None and previous is not value:
+                previous.unbind()
+            value.bind(self._world, self.state._index)
+        object.__setattr__(self, name, value)
+        # let the world know its property arrays or role lists are out of date
+        if self._world is not None:
+            if name in PHYSICAL_PROPERTIES:
+                self._world._properties_dirty = True
+            elif name in ROLE_PROPERTIES:
+                self._world._roles_dirty = True
+
 # properties of landmark entities
 class Landmark(Entity):
      def __init__(self):
@@ -160,10 +352,308 @@ class Agent(Entity):
         self.action_callback = None
         self.always_scripted = False
 
+# softmax penetration depth of two bodies at distance dist whose contact distance is dist_min
+def contact_penetration(dist, dist_min, contact_margin):
+    k = contact_margin
+    return np.logaddexp(0, (dist_min - dist)/k)*k
+
+# collision forces between all pairs of entities, computed in a single broadcast
+# (same math as World.get_entity_collision_force). p_pos has shape (..., n_entities, dim_p) and the
+# per-entity properties shape (..., n_entities), so a batch of worlds can be processed at once.
+# Precomputed pairwise deltas/distances (e.g. the world distance cache) can be passed in, and
+# contact_force / contact_margin can be scalars or broadcastable (..., 1, 1) per-batch arrays.
+# Returns the total collision force on each entity, with the same shape as p_pos.
+def entity_collision_forces(p_pos, size, mass, movable, collide, contact_force, contact_margin,
+                            delta_pos=None, dist=None):
+    dist_min, scale = collision_coefficients(size, mass, movable, collide)
+    return contact_forces(p_pos, dist_min, scale, contact_force, contact_margin, delta_pos, dist)
+
+# the parts of entity_collision_forces that only depend on entity properties: contact distances of all
+# pairs of entities and the scale of the force on entity a from entity b (mass ratio, zero for pairs that
+# do not collide), both of shape (..., n_entities, n_entities)
+def collision_coefficients(size, mass, movable, collide):
+    dist_min = size[..., :, None] + size[..., None, :]
+    # consider mass in collisions between two movable entities
+    mass_ratio = np.where(movable[..., None, :], mass[..., None, :] / mass[..., :, None], 1.0)
+    # only colliders, at least one of which moves, and an entity does not collide against itself
+    n = size.shape[-1]
+    active = collide[..., :, None] & collide[..., None, :] & movable[..., :, None] & ~np.eye(n, dtype=bool)
+    return dist_min, np.where(active, mass_ratio, 0.0)
+
+# collision forces between all pairs of entities, given their collision_coefficients
+def contact_forces(p_pos, dist_min, scale, contact_force, contact_margin, delta_pos=None, dist=None):
+    if delta_pos is None:
+        delta_pos = p_pos[..., :, None, :] - p_pos[..., None, :, :]
+        dist = np.sqrt(np.einsum('...i,...i->...', delta_pos, delta_pos))
+    dist = np.maximum(dist, 0.001)
+    penetration = contact_penetration(dist, dist_min, contact_margin)
+    # force on entity a from its contact with entity b is along delta_pos, summed over all b
+    return np.einsum('...ab,...abi->...ai', scale * (contact_force * penetration / dist), delta_pos)
+
+# pack the properties of a list of walls into arrays (one entry per wall)
+def pack_walls(walls):
+    return {
+        'horizontal': np.array([wall.orient == 'H' for wall in walls], dtype=bool),
+        'axis_pos': np.array([wall.axis_pos for wall in walls], dtype=float),
+        'endpoints': np.array([wall.endpoints for wall in walls], dtype=float).reshape(len(walls), 2),
+        'width': np.array([wall.width for wall in walls], dtype=float),
+        'hard': np.array([wall.hard for wall in walls], dtype=bool),
+    }
+
+# collision forces between all entities and all walls (packed with pack_walls), computed in a single
+# broadcast (same math as World.get_wall_collision_force). p_pos has shape (..., n_entities, 2) and
+# the per-entity properties shape (..., n_entities). Returns the total wall force on each entity.
+def wall_collision_forces(p_pos, size, movable, ghost, walls, contact_force, contact_margin):
+    horizontal = walls['horizontal']
+    # coordinate of each entity along (prll) and across (perp) each wall, shape (..., n, n_walls)
+    prll_dim = np.where(horizontal, 0, 1)
+    perp_dim = 1 - prll_dim
+    ent_prll = p_pos[..., prll_dim]
+    ent_perp = p_pos[..., perp_dim]
+    size = size[..., :, None]
+    start, end = walls['endpoints'][:, 0], walls['endpoints'][:, 1]
+    # entity is beyond endpoints of wall, or ghost passes through soft walls
+    active = (ent_prll >= start - size) & (ent_prll <= end + size)
+    active &= movable[..., :, None] & ~(ghost[..., :, None] & ~walls['hard'])
+    # part of entity is beyond wall
+    dist_past_end = np.where(ent_prll < start, ent_prll - start, np.where(ent_prll > end, ent_prll - end, 0.))
+    dist_past_end = np.where(active, dist_past_end, 0.)
+    theta = np.arcsin(np.clip(dist_past_end / size, -1., 1.))
+    dist_min = np.cos(theta) * size + 0.5 * walls['width']
+    # only need to calculate distance in relevant dim
+    delta_pos = ent_perp - walls['axis_pos']
+    dist = np.abs(delta_pos)
+    penetration = contact_penetration(dist, dist_min, contact_margin)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        force_mag = contact_force * delta_pos / dist * penetration
+    force_perp = np.where(active, np.cos(theta) * force_mag, 0.)
+    force_prll = np.where(active, np.sin(theta) * np.abs(force_mag), 0.)
+    force_x = np.where(horizontal, force_prll, force_perp)
+    force_y = np.where(horizontal, force_perp, force_prll)
+    return np.stack([np.sum(force_x, axis=-1), np.sum(force_y, axis=-1)], axis=-1)
+
+# pack the properties of a list of lines into arrays (one entry per line). Line endpoints are given
+# as indices of the entities in the world they are bound to.
+def pack_lines(lines):
+    return {
+        'entity1': np.array([line.entity1.state._index for line in lines], dtype=np.int64),
+        'entity2': np.array([line.entity2.state._index for line in lines], dtype=np.int64),
+        'hard': np.array([line.hard for line in lines], dtype=bool),
+        'movable': np.array([getattr(line, 'movable', True) for line in lines], dtype=bool),
+        'max_length': np.array([getattr(line, 'max_length', np.inf) for line in lines], dtype=float),
+        'connection': np.array([type(line) is ConnectionLine for line in lines], dtype=bool),
+    }
+
+# velocities of all entities after their elastic collisions with lines (packed with pack_lines),
+# same math as World.apply_line_entity_elastic_collision: collisions with all lines are detected in
+# a single broadcast, then velocities of colliding entities are reflected line by line.
+def line_collision_velocities(p_pos, p_vel, movable, ghost, lines):
+    start, end = p_pos[lines['entity1']], p_pos[lines['entity2']]
+    norm = lambda x: np.sqrt(np.sum(np.square(x), axis=-1))
+    # checks if entity has entered in collision with line, shape (n_entities, n_lines)
+    dist1 = norm(p_pos[:, None, :] - start[None, :, :])
+    dist2 = norm(p_pos[:, None, :] - end[None, :, :])
+    line_length = norm(start - end)
+    hit = dist1 + dist2 <= line_length + 0.005
+    # checks if entity can enter in collision with line
+    index = np.arange(len(p_pos))[:, None]
+    hit &= movable[:, None] & ~(ghost[:, None] & ~lines['hard'])
+    hit &= (index != lines['entity1']) & (index != lines['entity2'])
+    if not np.any(hit):
+        return p_vel
+    # normal vectors that point upward
+    vector = start - end
+    with np.errstate(invalid='ignore', divide='ignore'):
+        normal = np.stack([vector[:, 1], -vector[:, 0]], axis=1) / line_length[:, None]
+    normal = np.where(normal[:, 1:] >= 0., normal, -normal)
+    p_vel = np.copy(p_vel)
+    for l in np.flatnonzero(np.any(hit, axis=0)):
+        colliding = np.flatnonzero(hit[:, l])
+        entity_speed = norm(p_vel[colliding])[:, None]
+        R_i = p_vel[colliding] / (entity_speed + 1e-5)
+        R_r = R_i - 2 * normal[l] * R_i.dot(normal[l])[:, None]
+        p_vel[colliding] = entity_speed * R_r
+    return p_vel
+
+# integrate the state of all movable entities over one timestep, in place. Arrays may have leading
+# batch dimensions; dt and clip_positions can be scalars or broadcastable per-batch arrays.
+def integrate_entities(p_pos, p_vel, p_force, movable, mass, damping, max_speed, dt, clip_positions):
+    new_p_vel = p_vel * (1 - damping)[..., None]
+    new_p_vel += (p_force / mass[..., None]) * dt
+    speed = np.sqrt(np.einsum('...i,...i->...', new_p_vel, new_p_vel))
+    # scale down velocities above max speed
+    new_p_vel *= np.divide(max_speed, speed, out=np.ones(speed.shape), where=speed > max_speed)[..., None]
+    new_p_pos = p_pos + new_p_vel * dt
+    if clip_positions is not False and np.any(clip_positions):
+        new_p_pos = np.where(clip_positions, np.clip(new_p_pos, -1., 1.), new_p_pos)
+    np.copyto(p_vel, new_p_vel, where=movable[..., None])
+    np.copyto(p_pos, new_p_pos, where=movable[..., None])
+
+# planar worlds with at most this many entities (and no walls, lines or broadphase) are stepped entity by
+# entity on Python floats (see World._step_small): for so few entities, the fixed cost of whole-array numpy
+# calls outweighs the per-entity arithmetic
+SMALL_WORLD_SIZE = 12
+
+# contacts further apart than dist_min + BROADPHASE_CUTOFF * contact_margin are skipped by the
+# broadphase (their softmax penetration is below 1e-8 * contact_margin)
+BROADPHASE_CUTOFF = 20.
+
+# candidate pairs (ia, ib) of points closer than cell_size, found with a uniform grid / spatial hash:
+# points are binned in cells of side cell_size and only points in the same or neighboring cells are
+# paired, so the cost grows with the number of nearby pairs rather than with n_points ** 2.
+# Each unordered pair is returned once.
+def grid_candidate_pairs(p_pos, cell_size):
+    n, dim = p_pos.shape
+    if n < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    cells = np.floor(p_pos / cell_size).astype(np.int64)
+    # shift cells so that neighbors of every occupied cell have non-negative coordinates
+    cells -= cells.min(axis=0) - 1
+    spans = cells.max(axis=0) + 2
+    strides = np.concatenate([np.cumprod(spans[::-1])[::-1][1:], [1]])
+    keys = cells.dot(strides)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    # half of the neighborhood stencil (own cell + lexicographically positive offsets)
+    offsets = np.array(np.meshgrid(*[[-1, 0, 1]] * dim, indexing='ij')).reshape(dim, -1).T
+    offsets = [o for o in offsets if tuple(o) >= (0,) * dim]
+    ia, ib = [], []
+    for offset in offsets:
+        neighbor_keys = keys + offset.dot(strides)
+        start = np.searchsorted(sorted_keys, neighbor_keys, side='left')
+        end = np.searchsorted(sorted_keys, neighbor_keys, side='right')
+        counts = end - start
+        total = np.sum(counts)
+        if total == 0:
+            continue
+        a = np.repeat(np.arange(n), counts)
+        within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        b = order[np.repeat(start, counts) + within]
+        if not np.any(offset):
+            keep = a < b
+            a, b = a[keep], b[keep]
+        ia.append(a)
+        ib.append(b)
+    if not ia:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(ia), np.concatenate(ib)
+
+# collision forces for a list of entity pairs (ia, ib), same math as entity_collision_forces.
+# Pairs must be unique and unordered; returns the total collision force on each entity.
+def pair_collision_forces(p_pos, size, mass, movable, ia, ib, contact_force, contact_margin):
+    delta_pos = p_pos[ia] - p_pos[ib]
+    dist = np.sqrt(np.sum(np.square(delta_pos), axis=1))
+    dist_min = size[ia] + size[ib]
+    dist = np.where(np.abs(dist) > 0.001, dist, 0.001)
+    penetration = contact_penetration(dist, dist_min, contact_margin)
+    force = contact_force * delta_pos / dist[:, None] * penetration[:, None]
+    # consider mass in collisions between two movable entities
+    both = movable[ia] & movable[ib]
+    scale_a = np.where(both, mass[ib] / mass[ia], 1.0) * movable[ia]
+    scale_b = np.where(both, mass[ia] / mass[ib], 1.0) * movable[ib]
+    n, dim = p_pos.shape
+    forces = np.zeros((n, dim))
+    for d in range(dim):
+        forces[:, d] += np.bincount(ia, weights=scale_a * force[:, d], minlength=n)
+        forces[:, d] -= np.bincount(ib, weights=scale_b * force[:, d], minlength=n)
+    return forces
+
+# spatial index over a subset of entities, answering batched radius and k-nearest queries.
+# Uses a KD-tree (scipy.spatial.cKDTree, imported only if available) for large sets and a
+# brute-force distance matrix otherwise.
+class SpatialIndex(object):
+    # below this many points a brute-force distance matrix beats building a tree
+    min_tree_size = 64
+
+    def __init__(self, p_pos, indices):
+        # entity indices covered by the index and their positions
+        self.indices = indices
+        self.p_pos = p_pos[indices]
+        self.tree = None
+        if len(indices) >= self.min_tree_size:
+            try:
+                from scipy.spatial import cKDTree
+            except ImportError:
+                pass
+            else:
+                self.tree = cKDTree(self.p_pos)
+
+    def _distances(self, points):
+        return np.sqrt(np.sum(np.square(points[:, None, :] - self.p_pos[None, :, :]), axis=-1))
+
+    # k nearest entities to each point, as (m, k) entity indices and distances sorted by distance
+    # (padded with -1 and inf if there are fewer than k entities). The entity exclude[i], if given,
+    # is never returned for point i (e.g. to leave an agent out of its own neighbors).
+    def k_nearest(self, points, k, exclude=None):
+        m, n = len(points), len(self.indices)
+        n_query = min(k + (exclude is not None), n)
+        if n_query == 0:
+            return -np.ones((m, k), dtype=np.int64), np.full((m, k), np.inf)
+        if self.tree is not None:
+            dist, local = self.tree.query(points, k=n_query)
+            dist, local = dist.reshape(m, n_query), local.reshape(m, n_query)
+        else:
+            all_dist = self._distances(points)
+            local = np.argsort(all_dist, axis=1, kind='stable')[:, :n_query]
+            dist = np.take_along_axis(all_dist, local, axis=1)
+        idx = self.indices[local]
+        if exclude is not None:
+            # move the excluded entity (if found) to the end of its row
+            excluded = idx == np.asarray(exclude)[:, None]
+            order = np.argsort(excluded, axis=1, kind='stable')
+            idx = np.where(np.take_along_axis(excluded, order, axis=1), -1, np.take_along_axis(idx, order, axis=1))
+            dist = np.where(idx < 0, np.inf, np.take_along_axis(dist, order, axis=1))
+        idx, dist = idx[:, :k], dist[:, :k]
+        if idx.shape[1] < k:
+            pad = k - idx.shape[1]
+            idx = np.hstack([idx, -np.ones((m, pad), dtype=idx.dtype)])
+            dist = np.hstack([dist, np.full((m, pad), np.inf)])
+        return idx, dist
+
+    # entities within distance r of each point, as lists (one item per point) of entity index and
+    # distance arrays sorted by distance. r can be a scalar or one radius per point.
+    def query_radius(self, points, r, exclude=None):
+        r = np.broadcast_to(r, (len(points),))
+        idx_n, dist_n = [], []
+        if self.tree is not None:
+            neighbors = self.tree.query_ball_point(points, r)
+            for i, local in enumerate(neighbors):
+                local = np.asarray(local, dtype=np.int64)
+                dist = np.sqrt(np.sum(np.square(self.p_pos[local] - points[i]), axis=1))
+                idx_n.append(local)
+                dist_n.append(dist)
+        else:
+            all_dist = self._distances(points)
+            for i in range(len(points)):
+                local = np.flatnonzero(all_dist[i] <= r[i])
+                idx_n.append(local)
+                dist_n.append(all_dist[i, local])
+        for i in range(len(points)):
+            order = np.argsort(dist_n[i], kind='stable')
+            idx, dist = self.indices[idx_n[i][order]], dist_n[i][order]
+            if exclude is not None:
+                keep = idx != exclude[i]
+                idx, dist = idx[keep], dist[keep]
+            idx_n[i], dist_n[i] = idx, dist
+        return idx_n, dist_n
+
+# whether the policy's action_all computes the same actions as its action method: both must be defined by
+# the same class (a subclass overriding only action would otherwise get the actions of its parent)
+def _has_action_all(policy):
+    owners = {}
+    for cls in type(policy).__mro__:
+        for name in ('action', 'action_all'):
+            if name in vars(cls):
+                owners.setdefault(name, cls)
+    return 'action_all' in owners and owners['action_all'] is owners.get('action')
+
 # multi-agent world
 class World(object):
     def __init__(self):
+        # incremented whenever the agents or landmarks lists or the dimensions are assigned
+        self._version = 0
         # list of agents and entities (can change at execution-time!)
+        # assign new lists rather than modifying them in place, so that the world notices the change
         self.agents = []
         self.landmarks = []
         self.walls = []
@@ -179,54 +669,557 @@ class World(object):
         # contact response parameters
         self.contact_force = 1e+2
         self.contact_margin = 1e-3
-        # cache distances between all agents (not calculated by default)
+        # collision broadphase: None evaluates all pairs of entities, 'grid' only evaluates pairs of
+        # entities in neighboring cells of a uniform grid (for worlds with many entities)
+        self.broadphase = None
+        # cache distances between all agents (not calculated by default); the cache is filled on first use
+        # after the positions changed (see cached_dist_vect)
         self.cache_dists = False
-        self.cached_dist_vect = None
-        self.cached_dist_mag = None
+        self._cached_dist_vect = None
+        self._cached_dist_mag = None
+        self._cached_collisions = None
+        self._dist_version = None
+        self.min_dists = None
+        # contact distances and force scales of the colliders (see _gather_properties) as (n_entities,
+        # n_entities) arrays, to compute contact forces from the distance cache (built when first needed)
+        self._dense_collider_coefficients = None
         # whether or not to clip positions to constraint the agents to the visible screen
         self.clip_positions = False
+        # random generator for motor and communication noise (seeded from the global numpy RNG
+        # the first time noise is needed, unless seeded with World.seed)
+        self.np_random = None
+        # number of steps taken
+        self.step_count = 0
+        # incremented whenever the positions change (steps, set_state, position assignments, clear_step_cache):
+        # the step cache and the spatial indices only hold values computed for the current version
+        self._state_version = 0
+        # values memoized by scenario helpers until the world changes (see step_cache)
+        self._step_cache = {}
+        self._step_cache_version = 0
+        # names of entity attributes set by the scenario that are part of the state of the world (e.g. goals
+        # chosen at reset), saved and restored with get_state / set_state along with the physical state
+        self.state_attributes = []
+        # structure-of-arrays storage of entity states and properties (built lazily, see sync_arrays)
+        self._entities = []
+        self._bound_version = -1
+        self._properties_dirty = True
+        self._properties_version = 0
+        self._p_pos = np.zeros((0, self.dim_p))
+        self._p_vel = np.zeros((0, self.dim_p))
+        self._mass = np.zeros(0)
+        self._size = np.zeros(0)
+        self._damping = np.zeros(0)
+        self._max_speed = np.zeros(0)
+        self._accel = np.zeros(0)
+        self._movable = np.zeros(0, dtype=bool)
+        self._collide = np.zeros(0, dtype=bool)
+        self._ghost = np.zeros(0, dtype=bool)
+        # motor / communication noise amounts, and entities that receive them
+        self._u_noise = np.zeros(0)
+        self._c_noise = np.zeros(0)
+        self._u_noisy = np.zeros(0, dtype=np.int64)
+        self._c_noisy = np.zeros(0, dtype=np.int64)
+        self._noise_buffer = np.zeros(0)
+        self._no_noise = (np.zeros((0, self.dim_p)), np.zeros((0, self.dim_c)))
+        # physical / communication actions of the agents, and scale turning physical actions into forces
+        self._action_u = np.zeros((0, self.dim_p))
+        self._action_c = np.zeros((0, self.dim_c))
+        self._action_force_scale = np.zeros(0)
+        # movable agents, silent agents (rows), and entities taking part in collisions (see _gather_properties)
+        self._movable_agents = np.zeros(0, dtype=np.int64)
+        self._silent = np.zeros(0, dtype=np.int64)
+        self._colliders = np.zeros(0, dtype=np.int64)
+        self._collider_coefficients = (np.zeros((0, 0)), np.zeros((0, 0)))
+        # communication states of the agents
+        self._comm = np.zeros((0, self.dim_c))
+        # cached role lists and their indices among entities
+        self._roles_dirty = True
+        self._roles_version = 0
+        self._policy_agents = []
+        self._scripted_agents = []
+        self._agent_indices = np.zeros(0, dtype=np.int64)
+        self._landmark_indices = np.zeros(0, dtype=np.int64)
+        self._policy_agent_indices = np.zeros(0, dtype=np.int64)
+        self._scripted_agent_indices = np.zeros(0, dtype=np.int64)
+        self._scripted_groups = []
+        self._scripted_singles = []
+        # policies of the scripted agents that have a state (see get_state)
+        self._scripted_policies = []
+        # walls and lines packed with pack_walls / pack_lines, with the lists (and entity version) they were
+        # packed from (see get_packed_walls / get_packed_lines)
+        self._packed_walls = (None, None)
+        self._packed_lines = (None, None, None)
+        # spatial indices over (subsets of) the entities, rebuilt lazily after each step
+        self._spatial_indices = {}
+        self._spatial_version = 0
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in ('agents', 'landmarks', 'dim_p', 'dim_c'):
+            self._version += 1
+
+    # the lists below are cached until the entities or their roles change, do not modify them
 
     # return all entities in the world
     @property
     def entities(self):
-        return self.agents + self.landmarks
+        self._sync_entities()
+        return self._entities
 
     # return all agents controllable by external policies
     @property
     def policy_agents(self):
-        return [agent for agent in self.agents if agent.action_callback is None]
+        self._sync_entities()
+        return self._policy_agents
 
     # return all agents controlled by world scripts
     @property
     def scripted_agents(self):
-        return [agent for agent in self.agents if agent.action_callback is not None]
+        self._sync_entities()
+        return self._scripted_agents
+
+    # indices of agents / landmarks / policy agents / scripted agents among all entities
+    @property
+    def agent_indices(self):
+        self._sync_entities()
+        return self._agent_indices
+
+    @property
+    def landmark_indices(self):
+        self._sync_entities()
+        return self._landmark_indices
+
+    @property
+    def policy_agent_indices(self):
+        self._sync_entities()
+        return self._policy_agent_indices
+
+    @property
+    def scripted_agent_indices(self):
+        self._sync_entities()
+        return self._scripted_agent_indices
+
+    # positions of all entities, shape (n_entities, dim_p); entity.state.p_pos is a row of it. Assigning
+    # positions (world.p_pos = ... or entity.state.p_pos = ...) invalidates the step cache and the spatial
+    # indices; after writing into the array in place (e.g. world.p_pos[i] = ...) call clear_step_cache
+    @property
+    def p_pos(self):
+        self.sync_arrays()
+        return self._p_pos
+
+    @p_pos.setter
+    def p_pos(self, value):
+        self.sync_arrays()
+        self._p_pos[...] = value
+        self._state_version += 1
+
+    # values memoized by scenario helpers (see multiagent.scenario.step_cached), emptied whenever the
+    # positions change
+    @property
+    def step_cache(self):
+        if self._step_cache_version != self._state_version:
+            self._step_cache.clear()
+            self._step_cache_version = self._state_version
+        return self._step_cache
+
+    # distance cache (when cache_dists is set): vectors and distances between all entities, shapes
+    # (n_entities, n_entities, dim_p) and (n_entities, n_entities), and whether they are in contact. They are
+    # computed on first use after the positions changed, so enabling the cache costs nothing until it is read
+    @property
+    def cached_dist_vect(self):
+        self._update_distances()
+        return self._cached_dist_vect
+
+    @property
+    def cached_dist_mag(self):
+        self._update_distances()
+        return self._cached_dist_mag
+
+    @property
+    def cached_collisions(self):
+        self._update_distances()
+        return self._cached_collisions
+
+    def _update_distances(self):
+        if self.cache_dists and self._dist_version != self._state_version:
+            self.calculate_distances()
+
+    # velocities of all entities, shape (n_entities, dim_p); entity.state.p_vel is a row of it
+    @property
+    def p_vel(self):
+        self.sync_arrays()
+        return self._p_vel
+
+    # communication states of all agents, shape (n_agents, dim_c); agent.state.c is a row of it
+    @property
+    def comm(self):
+        self.sync_arrays()
+        return self._comm
+
+    # per-entity properties as arrays of shape (n_entities,)
+    @property
+    def entity_mass(self):
+        self.sync_arrays()
+        return self._mass
+
+    @property
+    def entity_size(self):
+        self.sync_arrays()
+        return self._size
+
+    @property
+    def entity_damping(self):
+        self.sync_arrays()
+        return self._damping
+
+    # max speed of each entity (inf where entity.max_speed is None)
+    @property
+    def entity_max_speed(self):
+        self.sync_arrays()
+        return self._max_speed
+
+    # acceleration of each entity (nan where entity.accel is None)
+    @property
+    def entity_accel(self):
+        self.sync_arrays()
+        return self._accel
+
+    @property
+    def movable_mask(self):
+        self.sync_arrays()
+        return self._movable
+
+    @property
+    def collide_mask(self):
+        self.sync_arrays()
+        return self._collide
+
+    @property
+    def ghost_mask(self):
+        self.sync_arrays()
+        return self._ghost
+
+    # make the state and property arrays match the current list of entities
+    def sync_arrays(self):
+        self._sync_entities()
+        if self._properties_dirty:
+            self._gather_properties()
+
+    # rebuild the entity list, state arrays and role lists if the entities changed
+    def _sync_entities(self):
+        if self._bound_version != self._version:
+            self._bind_entities(self.agents + self.landmarks)
+            self._bound_version = self._version
+        if self._roles_dirty:
+            self._gather_roles()
+
+    def _gather_roles(self):
+        scripted = np.array([agent.action_callback is not None for agent in self.agents], dtype=bool)
+        self._policy_agents = [agent for agent, s in zip(self.agents, scripted) if not s]
+        self._scripted_agents = [agent for agent, s in zip(self.agents, scripted) if s]
+        self._agent_indices = np.arange(len(self.agents))
+        self._landmark_indices = np.arange(len(self.agents), len(self._entities))
+        self._policy_agent_indices = np.flatnonzero(~scripted)
+        self._scripted_agent_indices = np.flatnonzero(scripted)
+        # scripted agents driven by the action method of a policy defining action_all are grouped by policy,
+        # the others call their callback once per agent (see set_scripted_actions)
+        groups = {}
+        self._scripted_singles = []
+        for agent in self._scripted_agents:
+            policy = getattr(agent.action_callback, '__self__', None)
+            if getattr(agent.action_callback, '__name__', None) == 'action' and _has_action_all(policy):
+                groups.setdefault(id(policy), (policy, []))[1].append(agent)
+            else:
+                self._scripted_singles.append(agent)
+        self._scripted_groups = [(policy, agents, np.array([agent.state._index for agent in agents], dtype=np.int64))
+                                 for policy, agents in groups.values()]
+        policies = {}
+        for agent in self._scripted_agents:
+            policy = getattr(agent.action_callback, '__self__', None)
+            if callable(getattr(policy, 'get_state', None)) and callable(getattr(policy, 'set_state', None)):
+                policies[id(policy)] = policy
+        self._scripted_policies = list(policies.values())
+        self._roles_dirty = False
+        self._roles_version += 1
+
+    def _bind_entities(self, entities):
+        for entity in self._entities:
+            if entity._world is self:
+                entity.state.unbind()
+                if hasattr(entity, 'action'):
+                    entity.action.unbind()
+                entity._world = None
+        n = len(entities)
+        self._p_pos = np.zeros((n, self.dim_p))
+        self._p_vel = np.zeros((n, self.dim_p))
+        # agents come first, so the row of an agent in the action arrays is its entity index
+        n_agents = len([entity for entity in entities if hasattr(entity, 'action')])
+        self._action_u = np.zeros((n_agents, self.dim_p))
+        self._action_c = np.zeros((n_agents, self.dim_c))
+        self._comm = np.zeros((n_agents, self.dim_c))
+        for i, entity in enumerate(entities):
+            if entity._world is not None and entity._world is not self:
+                entity.state.unbind()
+                if hasattr(entity, 'action'):
+                    entity.action.unbind()
+            entity.state.bind(self, i)
+            if hasattr(entity, 'action'):
+                entity.action.bind(self, i)
+            entity._world = self
+        self._entities = entities
+        # distance cache and spatial indices are indexed by entity
+        self._cached_dist_vect = None
+        self._state_version += 1
+        self._properties_dirty = True
+        self._roles_dirty = True
+
+    # store the entity states in the given (n_entities, dim_p) arrays (e.g. views into batch arrays)
+    def adopt_state_arrays(self, p_pos, p_vel):
+        self.sync_arrays()
+        p_pos[...] = self._p_pos
+        p_vel[...] = self._p_vel
+        self._p_pos, self._p_vel = p_pos, p_vel
+        self._state_version += 1
+
+    def _gather_properties(self):
+        entities = self._entities
+        self._mass = np.array([entity.mass for entity in entities], dtype=float)
+        self._size = np.array([entity.size for entity in entities], dtype=float)
+        self._damping = np.array([entity.damping for entity in entities], dtype=float)
+        self._max_speed = np.array([np.inf if entity.max_speed is None else entity.max_speed
+                                    for entity in entities], dtype=float)
+        self._accel = np.array([np.nan if entity.accel is None else entity.accel
+                                for entity in entities], dtype=float)
+        self._movable = np.array([entity.movable for entity in entities], dtype=bool)
+        self._collide = np.array([entity.collide for entity in entities], dtype=bool)
+        self._ghost = np.array([entity.ghost for entity in entities], dtype=bool)
+        self._u_noise = np.array([(getattr(entity, 'u_noise', None) or 0.) if entity.movable else 0.
+                                  for entity in entities], dtype=float)
+        self._c_noise = np.array([0. if getattr(entity, 'silent', True) else (entity.c_noise or 0.)
+                                  for entity in entities], dtype=float)
+        self._u_noisy = np.flatnonzero(self._u_noise)
+        self._c_noisy = np.flatnonzero(self._c_noise)
+        self._noise_buffer = np.zeros(len(self._u_noisy) * self.dim_p + len(self._c_noisy) * self.dim_c)
+        self._no_noise = (np.zeros((0, self.dim_p)), np.zeros((0, self.dim_c)))
+        n_agents = len(self._action_u)
+        self._action_force_scale = np.where(np.isnan(self._accel[:n_agents]), self._mass[:n_agents],
+                                            self._mass[:n_agents] * self._accel[:n_agents])
+        self._movable_agents = np.flatnonzero(self._movable[:n_agents])
+        self._silent = np.flatnonzero([entity.silent for entity in entities[:n_agents]])
+        # colliders, if there can be any collision (at least two colliders, one of which moves)
+        colliders = np.flatnonzero(self._collide)
+        self._colliders = colliders if len(colliders) >= 2 and np.any(self._movable[colliders]) else colliders[:0]
+        self._collider_coefficients = collision_coefficients(self._size[self._colliders], self._mass[self._colliders],
+                                                             self._movable[self._colliders],
+                                                             self._collide[self._colliders])
+        # Python copies of the properties used by the small-world step (see _step_small), entities being given
+        # by the offset 2 * i of their x coordinate in the flattened state arrays: force scales of the movable
+        # agents, offsets of the noisy agents, contact distance and force scales of the colliding pairs, and
+        # damping factor, mass and max speed of the movable entities
+        if len(entities) <= SMALL_WORLD_SIZE and self.dim_p == 2:
+            colliders = (2 * self._colliders).tolist()
+            dist_min, scale = (array.tolist() for array in self._collider_coefficients)
+            movable = np.flatnonzero(self._movable)
+            self._small_step = (
+                list(zip((2 * self._movable_agents).tolist(),
+                         self._action_force_scale[self._movable_agents].tolist())),
+                (2 * self._u_noisy).tolist(),
+                [(colliders[a], colliders[b], dist_min[a][b], scale[a][b], scale[b][a])
+                 for a in range(len(colliders)) for b in range(a + 1, len(colliders)) if scale[a][b] or scale[b][a]],
+                list(zip((2 * movable).tolist(), (1 - self._damping[movable]).tolist(), self._mass[movable].tolist(),
+                         self._max_speed[movable].tolist())))
+        else:
+            self._small_step = None
+        self._properties_dirty = False
+        self._properties_version += 1
+        # sizes may have changed
+        self.min_dists = None
+        self._dense_collider_coefficients = None
+
+    # spatial index over the entities with the given indices (all entities by default),
+    # built once per state of the world
+    def get_spatial_index(self, among=None):
+        self.sync_arrays()
+        if among is None:
+            among = np.arange(len(self._entities))
+        among = np.asarray(among, dtype=np.int64)
+        if self._spatial_version != self._state_version:
+            self._spatial_indices.clear()
+            self._spatial_version = self._state_version
+        key = among.tobytes()
+        index = self._spatial_indices.get(key)
+        if index is None:
+            index = SpatialIndex(self._p_pos, among)
+            self._spatial_indices[key] = index
+        return index
+
+    # k nearest entities to each of the (m, dim_p) points, searched among the given entity indices;
+    # returns (m, k) entity indices and distances (see SpatialIndex.k_nearest)
+    def k_nearest(self, points, k, among=None, exclude=None):
+        points = np.atleast_2d(points)
+        return self.get_spatial_index(among).k_nearest(points, k, exclude)
+
+    # entities within distance r of each of the (m, dim_p) points, searched among the given entity
+    # indices; returns per-point lists of entity indices and distances (see SpatialIndex.query_radius)
+    def query_radius(self, points, r, among=None, exclude=None):
+        points = np.atleast_2d(points)
+        return self.get_spatial_index(among).query_radius(points, r, exclude)
+
+    # pairs of overlapping entities (closer than the sum of their sizes, as in the scenarios' is_collision)
+    # in the current state of the world: returns a (k, 2) array of entity indices (i < j, sorted) and the
+    # (k,) penetration depths. Found once per state of the world with the collision broadphase (cleared
+    # with the step cache); physical contacts are the pairs where both entities collide (see collide_mask)
+    def get_contacts(self):
+        contacts = self.step_cache.get('contacts')
+        if contacts is None:
+            self.sync_arrays()
+            contacts = self.step_cache['contacts'] = self._find_contacts()
+        return contacts
+
+    def _find_contacts(self):
+        n = len(self._entities)
+        if n < 2 or np.max(self._size) <= 0:
+            return np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+        if self.broadphase == 'grid':
+            ia, ib = grid_candidate_pairs(self._p_pos, 2 * np.max(self._size))
+            ia, ib = np.minimum(ia, ib), np.maximum(ia, ib)
+            dist = np.sqrt(np.sum(np.square(self._p_pos[ia] - self._p_pos[ib]), axis=1))
+            penetration = self._size[ia] + self._size[ib] - dist
+            keep = np.flatnonzero(penetration > 0)
+            keep = keep[np.lexsort((ib[keep], ia[keep]))]
+            return np.stack([ia[keep], ib[keep]], axis=1), penetration[keep]
+        if self.cache_dists:
+            # reuse the distance cache (min_dists is set once the distances are computed)
+            dist = self.cached_dist_mag
+            penetration = self.min_dists - dist
+        else:
+            dist = np.sqrt(np.sum(np.square(self._p_pos[:, None, :] - self._p_pos[None, :, :]), axis=-1))
+            penetration = self._size[:, None] + self._size[None, :] - dist
+        ia, ib = np.nonzero(np.triu(penetration > 0, 1))
+        return np.stack([ia, ib], axis=1), penetration[ia, ib]
+
+    # (n_entities, n_entities) boolean matrix of overlapping entities (see get_contacts), False on the diagonal
+    def contact_adjacency(self):
+        adjacency = self.step_cache.get('contact_adjacency')
+        if adjacency is None:
+            pairs, _ = self.get_contacts()
+            n = len(self._entities)
+            adjacency = np.zeros((n, n), dtype=bool)
+            adjacency[pairs[:, 0], pairs[:, 1]] = True
+            adjacency[pairs[:, 1], pairs[:, 0]] = True
+            self.step_cache['contact_adjacency'] = adjacency
+        return adjacency
+
+    # whether two entities of this world overlap (see get_contacts)
+    def in_contact(self, entity1, entity2):
+        adjacency = self.contact_adjacency()
+        return bool(adjacency[entity1.state._index, entity2.state._index])
 
     def calculate_distances(self):
-        if self.cached_dist_vect is None:
+        self.sync_arrays()
+        n = len(self._entities)
+        if self._cached_dist_vect is None or self._cached_dist_vect.shape != (n, n, self.dim_p):
             # initialize distance data structure
-            self.cached_dist_vect = np.zeros((len(self.entities),
-                                              len(self.entities),
-                                              self.dim_p))
-            # calculate minimum distance for a collision between all entities
-            self.min_dists = np.zeros((len(self.entities), len(self.entities)))
-            for ia, entity_a in enumerate(self.entities):
-                for ib in range(ia + 1, len(self.entities)):
-                    entity_b = self.entities[ib]
-                    min_dist = entity_a.size + entity_b.size
-                    self.min_dists[ia, ib] = min_dist
-                    self.min_dists[ib, ia] = min_dist
-
-        for ia, entity_a in enumerate(self.entities):
-            for ib in range(ia + 1, len(self.entities)):
-                entity_b = self.entities[ib]
-                delta_pos = entity_a.state.p_pos - entity_b.state.p_pos
-                self.cached_dist_vect[ia, ib, :] = delta_pos
-                self.cached_dist_vect[ib, ia, :] = -delta_pos
-
-        self.cached_dist_mag = np.linalg.norm(self.cached_dist_vect, axis=2)
-        self.cached_collisions = (self.cached_dist_mag <= self.min_dists)
-
-    def assign_agent_colors(self):
+            self._cached_dist_vect = np.zeros((n, n, self.dim_p))
+            self._cached_dist_mag = np.zeros((n, n))
+            self._cached_collisions = np.zeros((n, n), dtype=bool)
+            self.min_dists = None
+        if self.min_dists is None:
+            # calculate minimum distance for a collision between all entities (rebuilt when sizes change)
+            self.min_dists = self._size[:, None] + self._size[None, :]
+            np.fill_diagonal(self.min_dists, 0.)
+
+        np.subtract(self._p_pos[:, None, :], self._p_pos[None, :, :], out=self._cached_dist_vect)
+        np.einsum('ijk,ijk->ij', self._cached_dist_vect, self._cached_dist_vect, out=self._cached_dist_mag)
+        np.sqrt(self._cached_dist_mag, out=self._cached_dist_mag)
+        np.less_equal(self._cached_dist_mag, self.min_dists, out=self._cached_collisions)
+        self._dist_version = self._state_version
+
+    # forget the values memoized by scenario helpers, the spatial indices and the cached distances. Steps,
+    # set_state, position assignments and environment resets do it already; call it after changing the world
+    # state by other means, e.g. writing into the position arrays in place (world.p_pos[i] = ...,
+    # entity.state.p_pos[0] = ...)
+    def clear_step_cache(self):
+        self._state_version += 1
+
+    # snapshot of the state of the world, to branch from it many times (e.g. for planning): copies of the
+    # positions, velocities, communication states and actions arrays, the step count, the state of the noise
+    # generator, the entity attributes named in state_attributes and the states of the policies of scripted
+    # agents (see multiagent.policy.Policy.get_state)
+    def get_state(self):
+        self.sync_arrays()
+        extras = [(i, name, _copy_state_value(getattr(entity, name)))
+                  for i, entity in enumerate(self._entities)
+                  for name in self.state_attributes if hasattr(entity, name)]
+        return {
+            'p_pos': self._p_pos.copy(),
+            'p_vel': self._p_vel.copy(),
+            'comm': self._comm.copy(),
+            'action_u': self._action_u.copy(),
+            'action_c': self._action_c.copy(),
+            'step_count': self.step_count,
+            'rng': None if self.np_random is None else self.np_random.bit_generator.state,
+            'extras': extras,
+            'policies': self._get_policy_states(),
+        }
+
+    def _get_policy_states(self):
+        return [(policy, policy.get_state()) for policy in self._scripted_policies]
+
+    # restore a snapshot taken by get_state on this world (or a world with the same entities): the state
+    # arrays are copied in place, so views held on them (entity states, batch arrays) stay valid
+    def set_state(self, state):
+        self.sync_arrays()
+        if state['p_pos'].shape != self._p_pos.shape or state['comm'].shape != self._comm.shape:
+            raise ValueError('State of a world with different entities: positions %s and communication %s, '
+                             'expected %s and %s' % (state['p_pos'].shape, state['comm'].shape,
+                                                     self._p_pos.shape, self._comm.shape))
+        np.copyto(self._p_pos, state['p_pos'])
+        np.copyto(self._p_vel, state['p_vel'])
+        np.copyto(self._comm, state['comm'])
+        np.copyto(self._action_u, state['action_u'])
+        np.copyto(self._action_c, state['action_c'])
+        self.step_count = state['step_count']
+        if state['rng'] is None:
+            self.np_random = None
+        else:
+            if self.np_random is None:
+                self.seed()
+            self.np_random.bit_generator.state = state['rng']
+        for i, name, value in state['extras']:
+            setattr(self._entities[i], name, _copy_state_value(value))
+        for policy, policy_state in state.get('policies', ()):
+            policy.set_state(policy_state)
+        # positions changed
+        self._state_version += 1
+
+    # seed the random generator used for motor and communication noise
+    def seed(self, seed=None):
+        self.np_random = np.random.default_rng(seed)
+
+    # draw the motor and communication noise of all noisy agents for this step in a single call,
+    # into a preallocated buffer. Returns (u_noise, c_noise) of shapes (n_agents, dim_p) and
+    # (n_agents, dim_c) for the agents in self._u_noisy and self._c_noisy respectively.
+    def sample_noise(self):
+        self.sync_arrays()
+        return self._sample_noise()
+
+    # sample_noise once the arrays are in sync
+    def _sample_noise(self):
+        if self._noise_buffer.size == 0:
+            return self._no_noise
+        n_u = len(self._u_noisy) * self.dim_p
+        if self.np_random is None:
+            self.seed(np.random.randint(2 ** 31))
+        self.np_random.standard_normal(out=self._noise_buffer)
+        u_noise = self._noise_buffer[:n_u].reshape(len(self._u_noisy), self.dim_p)
+        c_noise = self._noise_buffer[n_u:].reshape(len(self._c_noisy), self.dim_c)
+        u_noise *= self._u_noise[self._u_noisy, None]
+        c_noise *= self._c_noise[self._c_noisy, None]
+        return u_noise, c_noise
+
+    # color agents by role, with palettes of the given names (built-in or seaborn palettes)
+    def assign_agent_colors(self, adversary_palette='OrRd_d', good_palette='GnBu_d'):
         n_dummies = 0
         if hasattr(self.agents[0], 'dummy'):
             n_dummies = len([a for a in self.agents if a.dummy])
@@ -235,96 +1228,332 @@ class World(object):
             n_adversaries = len([a for a in self.agents if a.adversary])
         n_good_agents = len(self.agents) - n_adversaries - n_dummies
         dummy_colors = [(0, 0, 0)] * n_dummies
-        adv_colors = sns.color_palette("OrRd_d", n_adversaries)
-        good_colors = sns.color_palette("GnBu_d", n_good_agents)
+        adv_colors = color_palette(adversary_palette, n_adversaries)
+        good_colors = color_palette(good_palette, n_good_agents)
         colors = dummy_colors + adv_colors + good_colors
         for color, agent in zip(colors, self.agents):
             agent.color = color
 
     # update state of the world
     def step(self):
+        self.sync_arrays()
+        self._state_version += 1
         # set actions for scripted agents 
-        for agent in self.scripted_agents:
-            agent.action = agent.action_callback(agent, self)
-        # gather forces applied to entities
-        p_force = [None] * len(self.entities)
-        # apply agent physical controls
-        p_force = self.apply_action_force(p_force)
-        # apply environment forces
-        p_force = self.apply_environment_force(p_force)
-        # integrate physical state
-        self.integrate_state(p_force)
+        self._set_scripted_actions()
+        self._step_actions()
+
+    # update state of the world with the current actions of all agents, without calling the callbacks of
+    # scripted agents (whose actions are already set, e.g. by set_scripted_actions)
+    def step_actions(self):
+        self.sync_arrays()
+        self._step_actions()
+
+    # step_actions once the arrays are in sync
+    def _step_actions(self):
+        # draw motor and communication noise of all agents at once
+        u_noise, c_noise = self._sample_noise()
+        if self._small_step is not None and not self.walls and not self.lines and self.broadphase is None:
+            self._step_small(u_noise)
+        else:
+            # gather forces applied to entities
+            p_force = np.zeros((len(self._entities), self.dim_p))
+            # apply agent physical controls
+            p_force = self.apply_action_force(p_force, u_noise)
+            # apply environment forces
+            p_force = self.apply_environment_force(p_force)
+            # integrate physical state
+            self.integrate_state(p_force)
         # update agent state
-        for agent in self.agents:
-            self.update_agent_state(agent)
-        # calculate and store distances between all entities
-        if self.cache_dists:
-            self.calculate_distances()
+        self.update_agent_states(c_noise)
+        self.post_integrate()
+
+    # action forces, contact forces and integration of step_actions for small worlds (see SMALL_WORLD_SIZE),
+    # entity by entity on Python floats, with the same math as the whole-array functions
+    def _step_small(self, u_noise):
+        actions, noisy, pairs, movable = self._small_step
+        # flattened positions and forces, x and y of entity i at 2 * i and 2 * i + 1
+        pos = self._p_pos.ravel().tolist()
+        force = [0.0] * len(pos)
+        if actions:
+            u = self._action_u.ravel().tolist()
+            for i, scale in actions:
+                force[i] = scale * u[i]
+                force[i + 1] = scale * u[i + 1]
+        for i, (noise_x, noise_y) in zip(noisy, u_noise.tolist()):
+            force[i] += noise_x
+            force[i + 1] += noise_y
+        # collision response between entities (see contact_forces)
+        contact_force, k = self.contact_force, self.contact_margin
+        for a, b, dist_min, scale_a, scale_b in pairs:
+            dx = pos[a] - pos[b]
+            dy = pos[a + 1] - pos[b + 1]
+            dist = max(math.sqrt(dx * dx + dy * dy), 0.001)
+            # softmax penetration, as np.logaddexp(0, x) * k
+            x = (dist_min - dist) / k
+            penetration = (x + math.log1p(math.exp(-x)) if x > 0 else math.log1p(math.exp(x))) * k
+            magnitude = contact_force * penetration / dist
+            if scale_a:
+                force[a] += scale_a * magnitude * dx
+                force[a + 1] += scale_a * magnitude * dy
+            if scale_b:
+                force[b] -= scale_b * magnitude * dx
+                force[b + 1] -= scale_b * magnitude * dy
+        if not movable:
+            return
+        # integrate physical state (see integrate_entities)
+        vel = self._p_vel.ravel().tolist()
+        dt, clip_positions = self.dt, self.clip_positions
+        for i, keep, mass, max_speed in movable:
+            vx = vel[i] * keep + force[i] / mass * dt
+            vy = vel[i + 1] * keep + force[i + 1] / mass * dt
+            speed = math.sqrt(vx * vx + vy * vy)
+            if speed > max_speed:
+                vx *= max_speed / speed
+                vy *= max_speed / speed
+            vel[i], vel[i + 1] = vx, vy
+            x, y = pos[i] + vx * dt, pos[i + 1] + vy * dt
+            if clip_positions:
+                x, y = min(max(x, -1.), 1.), min(max(y, -1.), 1.)
+            pos[i], pos[i + 1] = x, y
+        self._p_pos.flat = pos
+        self._p_vel.flat = vel
 
+    # set the actions of scripted agents: agents whose callback is the action method of a policy defining
+    # action_all(agents, world) (see multiagent.policy.Policy) get their physical actions from a single call
+    # per policy (and no communication action, like a new Action), the others call their callback
+    def set_scripted_actions(self):
+        self._sync_entities()
+        self._set_scripted_actions()
+
+    # set_scripted_actions once the entities are in sync
+    def _set_scripted_actions(self):
+        for policy, agents, rows in self._scripted_groups:
+            self._action_u[rows] = policy.action_all(agents, self)
+            self._action_c[rows] = 0.0
+        for agent in self._scripted_singles:
+            agent.action = agent.action_callback(agent, self)
+
+    # advance the world T steps and record its trajectory, without any environment bookkeeping (meant for
+    # worlds driven by scripted agents, the other agents keep their current actions). Returns the
+    # (T, n_entities, dim_p) positions and velocities after each step, preallocated, and if reward_callback
+    # is given (a function of the world returning the rewards of all agents, such as a scenario's
+    # reward_all) the (T, n_agents) rewards after each step
+    def rollout(self, T, reward_callback=None):
+        self.sync_arrays()
+        trajectory = {'p_pos': np.zeros((T,) + self._p_pos.shape), 'p_vel': np.zeros((T,) + self._p_vel.shape)}
+        if reward_callback is not None:
+            trajectory['rewards'] = np.zeros((T, len(self.agents)))
+        for t in range(T):
+            self.step()
+            trajectory['p_pos'][t] = self._p_pos
+            trajectory['p_vel'][t] = self._p_vel
+            if reward_callback is not None:
+                trajectory['rewards'][t] = reward_callback(self)
+        return trajectory
+
+    # step K copies of the current state at once, with K candidate actions of all agents: action_u and
+    # action_c of shapes (K, n_agents, dim_p) and (K, n_agents, dim_c), whose rows for scripted agents are
+    # replaced by the actions of their callbacks (called once, from the shared state). All branches get
+    # the same motor and communication noise, so each one is what World.step would give with its actions.
+    # Returns the K states after the step (see get_state) and leaves the world and the states of the policies
+    # of its scripted agents unchanged.
+    def step_branches(self, action_u, action_c):
+        self.sync_arrays()
+        start = self.get_state()
+        self.set_scripted_actions()
+        # states the scripted policies are left in by the step, restored to their start states with the world
+        policies = self._get_policy_states()
+        scripted = self._scripted_agent_indices
+        k = len(action_u)
+        action_u = np.array(action_u, dtype=float).reshape((k,) + self._action_u.shape)
+        action_c = np.array(action_c, dtype=float).reshape((k,) + self._action_c.shape)
+        action_u[:, scripted] = self._action_u[scripted]
+        action_c[:, scripted] = self._action_c[scripted]
+        p_pos = np.repeat(self._p_pos[None], k, axis=0)
+        p_vel = np.repeat(self._p_vel[None], k, axis=0)
+        comm = np.empty((k,) + self._comm.shape)
+        if self.walls or self.lines or self.broadphase is not None:
+            # one branch at a time
+            for b in range(k):
+                self.set_state(start)
+                self._action_u[...] = action_u[b]
+                self._action_c[...] = action_c[b]
+                self.step_actions()
+                p_pos[b], p_vel[b], comm[b] = self._p_pos, self._p_vel, self._comm
+            rng = None if self.np_random is None else self.np_random.bit_generator.state
+        else:
+            u_noise, c_noise = self.sample_noise()
+            rng = None if self.np_random is None else self.np_random.bit_generator.state
+            # same forces and integration as World.step, with a leading branch dimension
+            movable = self._movable_agents
+            p_force = np.zeros_like(p_pos)
+            p_force[:, movable] = self._action_force_scale[movable, None] * action_u[:, movable]
+            p_force[:, self._u_noisy] += u_noise
+            p_force += self.get_dense_collision_forces(p_pos)
+            integrate_entities(p_pos, p_vel, p_force, self._movable, self._mass, self._damping, self._max_speed,
+                               self.dt, self.clip_positions)
+            comm[...] = action_c
+            comm[:, self._c_noisy] += c_noise
+            comm[:, self._silent] = 0.0
+        self.set_state(start)
+        return [dict(start, p_pos=p_pos[b], p_vel=p_vel[b], comm=comm[b], action_u=action_u[b],
+                     action_c=action_c[b], step_count=start['step_count'] + 1, rng=rng, policies=policies)
+                for b in range(k)]
+
+    # bookkeeping once the state of the world changed
+    def post_integrate(self):
+        self.step_count += 1
+        # positions changed, spatial indices, memoized scenario values and cached distances are out of date
+        self._state_version += 1
 
     # gather agent action forces
-    def apply_action_force(self, p_force):
+    def apply_action_force(self, p_force, u_noise=None):
+        if u_noise is None:
+            u_noise, _ = self.sample_noise()
         # set applied forces
-        for i,agent in enumerate(self.agents):
-            if agent.movable:
-                noise = np.random.randn(*agent.action.u.shape) * agent.u_noise if agent.u_noise else 0.0
-                p_force[i] = (agent.mass * agent.accel if agent.accel is not None else agent.mass) * agent.action.u + noise
+        movable = self._movable_agents
+        p_force[movable] = self._action_force_scale[movable, None] * self._action_u[movable]
+        if len(self._u_noisy) > 0:
+            p_force[self._u_noisy] += u_noise
         return p_force
 
     # gather physical forces acting on entities
     def apply_environment_force(self, p_force):
-        # simple (but inefficient) collision response
-        for a,entity_a in enumerate(self.entities):
-            for b,entity_b in enumerate(self.entities):
-                if(b <= a): continue
-                [f_a, f_b] = self.get_entity_collision_force(a, b)
-                if(f_a is not None):
-                    if(p_force[a] is None): p_force[a] = 0.0
-                    p_force[a] = f_a + p_force[a] 
-                if(f_b is not None):
-                    if(p_force[b] is None): p_force[b] = 0.0
-                    p_force[b] = f_b + p_force[b]
-            if entity_a.movable:
-                for wall in self.walls:
-                    wf = self.get_wall_collision_force(entity_a, wall)
-                    if wf is not None:
-                        if p_force[a] is None:
-                            p_force[a] = 0.0
-                        p_force[a] = p_force[a] + wf
-                for line in self.lines:
-                    self.apply_line_entity_elastic_collision(entity_a, line)  # Not very clean.. find a better way to integrate entity-line elastic collision than just resetting entity's speed
+        # collision response between entities
+        p_force += self.get_entity_collision_forces()
+        return self.apply_obstacle_force(p_force)
 
+    # gather forces (and velocity changes) due to walls and lines
+    def apply_obstacle_force(self, p_force):
+        # collision response between entities and walls
+        if self.walls:
+            p_force += wall_collision_forces(self._p_pos, self._size, self._movable, self._ghost,
+                                             self.get_packed_walls(), self.contact_force, self.contact_margin)
+        # elastic collisions between entities and lines (directly reflects entities' speed)
+        if self.lines:
+            self._p_vel[...] = line_collision_velocities(self._p_pos, self._p_vel, self._movable, self._ghost,
+                                                         self.get_packed_lines())
         return p_force
 
+    # walls packed with pack_walls, cached until world.walls is assigned (assign a new list rather than
+    # modifying walls in place, as for agents and landmarks)
+    def get_packed_walls(self):
+        walls, packed = self._packed_walls
+        if walls is not self.walls:
+            packed = pack_walls(self.walls)
+            self._packed_walls = (self.walls, packed)
+        return packed
+
+    # lines packed with pack_lines, cached until world.lines or the entities are assigned (assign a new list
+    # rather than modifying lines in place)
+    def get_packed_lines(self):
+        self._sync_entities()
+        lines, version, packed = self._packed_lines
+        if lines is not self.lines or version != self._version:
+            packed = pack_lines(self.lines)
+            self._packed_lines = (self.lines, self._version, packed)
+        return packed
+
+    # get collision forces on all entities from their contacts with each other
+    def get_entity_collision_forces(self):
+        if self.broadphase == 'grid':
+            return self.get_broadphase_collision_forces()
+        if self.broadphase is not None:
+            raise ValueError('Unknown collision broadphase: %s' % self.broadphase)
+        return self.get_dense_collision_forces(self._p_pos)
+
+    # get collision forces on all entities with positions p_pos, of shape (..., n_entities, dim_p), evaluating
+    # all pairs of colliders at once (only colliders are considered, and none if less than two of them collide)
+    def get_dense_collision_forces(self, p_pos):
+        colliders = self._colliders
+        forces = np.zeros_like(p_pos)
+        if len(colliders) == 0:
+            return forces
+        if p_pos is self._p_pos and self.cache_dists and self._dist_version == self._state_version:
+            # distances already computed for this state (e.g. by a reward): forces on all entities from the
+            # whole cache, with zero scales for the pairs that do not collide
+            if self._dense_collider_coefficients is None:
+                n, pairs = len(self._entities), np.ix_(colliders, colliders)
+                dist_min, scale = np.zeros((n, n)), np.zeros((n, n))
+                dist_min[pairs], scale[pairs] = self._collider_coefficients
+                self._dense_collider_coefficients = dist_min, scale
+            dist_min, scale = self._dense_collider_coefficients
+            return contact_forces(p_pos, dist_min, scale, self.contact_force, self.contact_margin,
+                                  self._cached_dist_vect, self._cached_dist_mag)
+        dist_min, scale = self._collider_coefficients
+        forces[..., colliders, :] = contact_forces(p_pos[..., colliders, :], dist_min, scale, self.contact_force,
+                                                   self.contact_margin)
+        return forces
+
+    # get collision forces on all entities, only evaluating pairs close enough to be in contact
+    def get_broadphase_collision_forces(self):
+        colliders = np.flatnonzero(self._collide)
+        forces = np.zeros_like(self._p_pos)
+        if len(colliders) < 2:
+            return forces
+        cell_size = 2 * np.max(self._size[colliders]) + BROADPHASE_CUTOFF * self.contact_margin
+        ia, ib = grid_candidate_pairs(self._p_pos[colliders], cell_size)
+        ia, ib = colliders[ia], colliders[ib]
+        # neither entity moves
+        keep = self._movable[ia] | self._movable[ib]
+        forces += pair_collision_forces(self._p_pos, self._size, self._mass, self._movable, ia[keep],
+                                        ib[keep], self.contact_force, self.contact_margin)
+        return forces
+
     # integrate physical state
     def integrate_state(self, p_force):
-        for line in self.lines:
-            if type(line) is ConnectionLine:
-                line.save_previous_endpoints()
-        for i,entity in enumerate(self.entities):
-            if not entity.movable: continue
-            entity.state.p_vel = entity.state.p_vel * (1 - entity.damping)
-            if (p_force[i] is not None):
-                entity.state.p_vel += (p_force[i] / entity.mass) * self.dt
-            if entity.max_speed is not None:
-                speed = np.sqrt(np.sum(np.square(entity.state.p_vel)))
-                if speed > entity.max_speed:
-                    entity.state.p_vel = entity.max_speed * entity.state.p_vel / speed
-            entity.state.p_pos += entity.state.p_vel * self.dt
-            if self.clip_positions:
-                entity.state.p_pos = np.clip(entity.state.p_pos, -1., 1.)
-        for line in self.lines:
-            if type(line) is ConnectionLine:
-                if not(line.is_movable()):
-                    line.entity1.state.p_pos = line.previous_endpoint1
-                    line.entity2.state.p_pos = line.previous_endpoint2
-
-    def update_agent_state(self, agent):
+        if self.lines:
+            previous_p_pos = np.copy(self._p_pos)
+        # whole-array update of all movable entities
+        integrate_entities(self._p_pos, self._p_vel, p_force, self._movable, self._mass, self._damping,
+                           self._max_speed, self.dt, self.clip_positions)
+        if self.lines:
+            self.apply_line_constraints(previous_p_pos, self.get_packed_lines())
+
+    # connection lines that cannot move or exceed their max length prevent their endpoints from moving
+    def apply_line_constraints(self, previous_p_pos, lines):
+        entity1, entity2 = lines['entity1'], lines['entity2']
+        blocked = lines['connection'] & ~lines['movable']
+        while True:
+            # roll back endpoints of blocked lines (which can stretch lines sharing an endpoint)
+            endpoints = np.concatenate([entity1[blocked], entity2[blocked]])
+            self._p_pos[endpoints] = previous_p_pos[endpoints]
+            length = np.sqrt(np.sum(np.square(self._p_pos[entity1] - self._p_pos[entity2]), axis=1))
+            exceeding = lines['connection'] & ~blocked & (length > lines['max_length'])
+            if not np.any(exceeding):
+                break
+            blocked |= exceeding
+        # endpoints of blocked lines are shown in black, those of the other lines in the colors saved by the
+        # line (as in ConnectionLine.is_movable, the last line of an entity decides its color)
+        for j in np.flatnonzero(lines['connection']):
+            line = self.lines[j]
+            if blocked[j]:
+                line.entity1.color = np.array([0., 0., 0.])
+                line.entity2.color = np.array([0., 0., 0.])
+            else:
+                line.entity1.color = np.copy(line.entity1_color)
+                line.entity2.color = np.copy(line.entity2_color)
+
+    # update the state of all agents, c_noise being the communication noise of the agents in _c_noisy
+    def update_agent_states(self, c_noise):
+        # set communication state (directly for now), same as update_agent_state for all agents at once
+        if self._comm.size == 0:
+            return
+        self._comm[...] = self._action_c
+        if len(self._c_noisy) > 0:
+            self._comm[self._c_noisy] += c_noise
+        if len(self._silent) > 0:
+            self._comm[self._silent] = 0.0
+
+    def update_agent_state(self, agent, noise=None):
         # set communication state (directly for now)
         if agent.silent:
             agent.state.c = np.zeros(self.dim_c)
         else:
-            noise = np.random.randn(*agent.action.c.shape) * agent.c_noise if agent.c_noise else 0.0
+            if noise is None:
+                if self.np_random is None:
+                    self.seed(np.random.randint(2 ** 31))
+                noise = self.np_random.standard_normal(agent.action.c.shape) * agent.c_noise if agent.c_noise else 0.0
             agent.state.c = agent.action.c + noise      
 
     # get collision forces for any contact between two entities
@@ -349,8 +1578,7 @@ class World(object):
             dist_min = entity_a.size + entity_b.size
         # softmax penetration
         dist = dist if abs(dist) > 0.001 else 0.001
-        k = self.contact_margin
-        penetration = np.logaddexp(0, -(dist - dist_min)/k)*k
+        penetration = contact_penetration(dist, dist_min, self.contact_margin)
         force = self.contact_force * delta_pos / dist * penetration
         if entity_a.movable and entity_b.movable:
             # consider mass in collisions
@@ -394,8 +1622,7 @@ class World(object):
         delta_pos = ent_pos[perp_dim] - wall.axis_pos
         dist = np.abs(delta_pos)
         # softmax penetration
-        k = self.contact_margin
-        penetration = np.logaddexp(0, -(dist - dist_min)/k)*k
+        penetration = contact_penetration(dist, dist_min, self.contact_margin)
         force_mag = self.contact_force * delta_pos / dist * penetration
         force = np.zeros(2)
         force[perp_dim] = np.cos(theta) * force_mag
@@ -423,3 +1650,169 @@ class World(object):
             return
         else:
             return
+
+
+# batch of worlds with the same entities (e.g. copies of a scenario's world), stepped together:
+# the entity states of all worlds are held in (n_worlds, n_entities, dim_p) arrays (each world's
+# state arrays being views into them), and action forces, collisions and integration are computed
+# for all worlds in one pass. Scripted agents, walls, lines and communication are handled per world.
+class BatchWorld(object):
+    def __init__(self, worlds):
+        self.worlds = list(worlds)
+        self._p_pos = None
+        self._p_vel = None
+        self._properties_versions = None
+        # policy groups of the first world computed for all worlds at once (see set_scripted_actions), and the
+        # role versions of the worlds they were found for
+        self._batched_groups = []
+        self._roles_versions = None
+
+    # positions / velocities of all entities of all worlds, shape (n_worlds, n_entities, dim_p). Assigning
+    # positions sets the positions of all worlds (see World.p_pos for in-place writes)
+    @property
+    def p_pos(self):
+        self.sync_arrays()
+        return self._p_pos
+
+    @p_pos.setter
+    def p_pos(self, value):
+        self.sync_arrays()
+        self._p_pos[...] = value
+        for world in self.worlds:
+            world.clear_step_cache()
+
+    @property
+    def p_vel(self):
+        self.sync_arrays()
+        return self._p_vel
+
+    # make the batch arrays match the worlds' entities and properties
+    def sync_arrays(self):
+        for world in self.worlds:
+            world.sync_arrays()
+        if self._p_pos is None or any(world._p_pos.base is not self._p_pos or world._p_vel.base is not self._p_vel
+                                      for world in self.worlds):
+            shapes = set(world._p_pos.shape for world in self.worlds)
+            if len(shapes) != 1:
+                raise ValueError('All worlds of a batch must have the same entities, got shapes %s' % shapes)
+            self._p_pos = np.stack([world._p_pos for world in self.worlds])
+            self._p_vel = np.stack([world._p_vel for world in self.worlds])
+            for b, world in enumerate(self.worlds):
+                world.adopt_state_arrays(self._p_pos[b], self._p_vel[b])
+            self._properties_versions = None
+        versions = [(id(world), world._properties_version) for world in self.worlds]
+        if versions != self._properties_versions:
+            self._mass = np.stack([world._mass for world in self.worlds])
+            self._size = np.stack([world._size for world in self.worlds])
+            self._damping = np.stack([world._damping for world in self.worlds])
+            self._max_speed = np.stack([world._max_speed for world in self.worlds])
+            self._movable = np.stack([world._movable for world in self.worlds])
+            self._collide = np.stack([world._collide for world in self.worlds])
+            # entities colliding in some world
+            self._colliders = np.flatnonzero(np.any(self._collide, axis=0))
+            colliders = self._colliders
+            self._collider_coefficients = collision_coefficients(self._size[:, colliders], self._mass[:, colliders],
+                                                                 self._movable[:, colliders],
+                                                                 self._collide[:, colliders])
+            self._dt = np.array([world.dt for world in self.worlds])[:, None, None]
+            self._clip_positions = np.array([world.clip_positions for world in self.worlds])[:, None, None]
+            self._contact_force = np.array([world.contact_force for world in self.worlds])[:, None, None]
+            self._contact_margin = np.array([world.contact_margin for world in self.worlds])[:, None, None]
+            self._properties_versions = versions
+
+    # update state of all the worlds
+    def step(self):
+        self.sync_arrays()
+        for world in self.worlds:
+            world._state_version += 1
+        # set actions for scripted agents
+        self.set_scripted_actions()
+        # gather forces applied to entities
+        p_force = np.zeros_like(self._p_pos)
+        c_noise = []
+        for b, world in enumerate(self.worlds):
+            u_noise, world_c_noise = world.sample_noise()
+            world.apply_action_force(p_force[b], u_noise)
+            c_noise.append(world_c_noise)
+        # collision response between entities, in a single pass unless a world uses a broadphase
+        if any(world.broadphase is not None for world in self.worlds):
+            for b, world in enumerate(self.worlds):
+                p_force[b] += world.get_entity_collision_forces()
+        else:
+            colliders = self._colliders
+            if len(colliders) >= 2:
+                dist_min, scale = self._collider_coefficients
+                p_force[:, colliders] += contact_forces(self._p_pos[:, colliders], dist_min, scale,
+                                                        self._contact_force, self._contact_margin)
+        for b, world in enumerate(self.worlds):
+            world.apply_obstacle_force(p_force[b])
+        # integrate physical state
+        previous_p_pos = np.copy(self._p_pos) if any(world.lines for world in self.worlds) else None
+        integrate_entities(self._p_pos, self._p_vel, p_force, self._movable, self._mass, self._damping,
+                           self._max_speed, self._dt, self._clip_positions)
+        for b, world in enumerate(self.worlds):
+            if world.lines:
+                world.apply_line_constraints(previous_p_pos[b], world.get_packed_lines())
+            # update agent state
+            world.update_agent_states(c_noise[b])
+            world.post_integrate()
+
+    # set the actions of the scripted agents of all worlds (see World.set_scripted_actions). Policy groups of
+    # batchable policies (see multiagent.policy.Policy) that all worlds have, with policies of the same type and
+    # batch attributes driving the same agents, and the same agent roles, are computed for all worlds at once
+    # from the batch positions; the other groups are computed per world
+    def set_scripted_actions(self):
+        for world in self.worlds:
+            world._sync_entities()
+        versions = [(id(world), world._roles_version) for world in self.worlds]
+        if versions != self._roles_versions:
+            self._batched_groups = self._find_batched_groups()
+            self._roles_versions = versions
+        batched = set()
+        for g in self._batched_groups:
+            policies = [world._scripted_groups[g][0] for world in self.worlds]
+            attributes = policies[0].batch_attributes
+            values = [getattr(policies[0], name) for name in attributes]
+            if any([getattr(policy, name) for name in attributes] != values for policy in policies[1:]):
+                continue
+            _, agents, rows = self.worlds[0]._scripted_groups[g]
+            u = policies[0].action_all(agents, self.worlds[0], self._p_pos)
+            for b, world in enumerate(self.worlds):
+                world._action_u[rows] = u[b]
+                world._action_c[rows] = 0.0
+            batched.add(g)
+        for world in self.worlds:
+            for g, (policy, agents, rows) in enumerate(world._scripted_groups):
+                if g not in batched:
+                    world._action_u[rows] = policy.action_all(agents, world)
+                    world._action_c[rows] = 0.0
+            for agent in world._scripted_singles:
+                agent.action = agent.action_callback(agent, world)
+
+    # indices of the policy groups that can be computed for all worlds at once (see set_scripted_actions)
+    def _find_batched_groups(self):
+        def roles(world):
+            return ([(type(policy), rows.tobytes()) for policy, _, rows in world._scripted_groups],
+                    [getattr(agent, 'adversary', None) for agent in world.agents])
+        first = roles(self.worlds[0])
+        if any(roles(world) != first for world in self.worlds[1:]):
+            return []
+        return [g for g, (policy, _, _) in enumerate(self.worlds[0]._scripted_groups)
+                if getattr(policy, 'batch_attributes', None) is not None]
+
+    # advance all the worlds T steps together and record their trajectories (see World.rollout): returns
+    # the (T, n_worlds, n_entities, dim_p) positions and velocities and, if reward_callback is given, the
+    # (T, n_worlds, n_agents) rewards after each step
+    def rollout(self, T, reward_callback=None):
+        self.sync_arrays()
+        trajectory = {'p_pos': np.zeros((T,) + self._p_pos.shape), 'p_vel': np.zeros((T,) + self._p_vel.shape)}
+        if reward_callback is not None:
+            trajectory['rewards'] = np.zeros((T, len(self.worlds), len(self.worlds[0].agents)))
+        for t in range(T):
+            self.step()
+            trajectory['p_pos'][t] = self._p_pos
+            trajectory['p_vel'][t] = self._p_vel
+            if reward_callback is not None:
+                for b, world in enumerate(self.worlds):
+                    trajectory['rewards'][t, b] = reward_callback(world)
+        return trajectory
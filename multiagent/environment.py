@@ -1,7 +1,16 @@
 import gym
 from gym import spaces
+import inspect
 from gym.envs.registration import EnvSpec
+import multiprocessing
+from multiprocessing import shared_memory
+import os
 import numpy as np
+from multiagent.core import BatchWorld
+
+# with fewer policy agents than this, calling the per-agent reward / observation callbacks is cheaper
+# than building the arrays of the vectorized ones
+VECTORIZED_MIN_AGENTS = 3
 
 # environment for all agents in the multiagent world
 # currently code assumes that no agents will be created/destroyed at runtime!
@@ -13,7 +22,9 @@ class MultiAgentEnv(gym.Env):
     def __init__(self, world, reset_callback=None, reward_callback=None,
                  observation_callback=None, info_callback=None,
                  done_callback=None, post_step_callback=None,
-                 shared_viewer=True, discrete_action=False):
+                 shared_viewer=True, discrete_action=False,
+                 frame_skip=1, sum_skipped_rewards=False, preallocated=False,
+                 reward_all_callback=None, observation_all_callback=None):
 
         self.world = world
         self.agents = self.world.policy_agents
@@ -26,6 +37,11 @@ class MultiAgentEnv(gym.Env):
         self.info_callback = info_callback
         self.done_callback = done_callback
         self.post_step_callback = post_step_callback
+        # optional vectorized scenario callbacks, computing the rewards / observations of all agents of
+        # the world at once (used instead of reward_callback / observation_callback when given, unless the
+        # env has fewer than VECTORIZED_MIN_AGENTS agents)
+        self.reward_all_callback = reward_all_callback
+        self.observation_all_callback = observation_all_callback
         # environment parameters
         self.discrete_action_space = discrete_action
         # if true, action is a number 0...N, otherwise action is a one-hot N-dimensional vector
@@ -34,6 +50,10 @@ class MultiAgentEnv(gym.Env):
         self.force_discrete_action = world.discrete_action if hasattr(world, 'discrete_action') else False
         # if true, every agent has the same reward
         self.shared_reward = False
+        # number of world steps per env step (the actions are held for all of them); observations
+        # and rewards are only computed after the last one, unless skipped rewards are summed
+        self.frame_skip = frame_skip
+        self.sum_skipped_rewards = sum_skipped_rewards
         self.time = 0
 
         # configure spaces
@@ -67,6 +87,23 @@ class MultiAgentEnv(gym.Env):
             self.observation_space.append(spaces.Box(low=-np.inf, high=+np.inf, shape=(obs_dim,)))
             agent.action.c = np.zeros(self.world.dim_c)
 
+        # if preallocated, step and reset return views of buffers owned by the env instead of new lists:
+        # (n_agents, obs_dim) float32 observations (zero-padded past each agent's obs_dim) and (n_agents,)
+        # rewards and dones. Scenarios whose observation takes an out argument write straight into the
+        # agent's row, others are copied into it.
+        self.obs_buffer = None
+        self.reward_buffer = None
+        self.done_buffer = None
+        if preallocated:
+            self._obs_dims = [space.shape[0] for space in self.observation_space]
+            self.obs_buffer = np.zeros((self.n, max(self._obs_dims)), dtype=np.float32)
+            self.reward_buffer = np.zeros(self.n)
+            self.done_buffer = np.zeros(self.n, dtype=bool)
+        self._observation_out = (observation_callback is not None and
+                                 'out' in inspect.signature(observation_callback).parameters)
+        # how (n_agents, act_dim) action arrays are decoded (see _decode_actions)
+        self._action_plan = self._make_action_plan()
+
         # rendering
         self.shared_viewer = shared_viewer
         if self.shared_viewer:
@@ -77,27 +114,127 @@ class MultiAgentEnv(gym.Env):
 
     def _seed(self, seed=None):
         if seed is None:
-            np.random.seed(1)
-        else:
-            np.random.seed(seed)
+            seed = 1
+        np.random.seed(seed)
+        self.world.seed(seed)
 
     def _step(self, action_n):
-        obs_n = []
-        reward_n = []
-        done_n = []
-        info_n = {'n': []}
+        self._set_actions(action_n)
+        # advance world state (holding the actions for frame_skip world steps)
+        skipped_reward_n = [0.0] * len(self.agents)
+        for _ in range(self.frame_skip - 1):
+            self.world.step()
+            skipped_reward_n = self._skipped_step(skipped_reward_n)
+        self.world.step()
+        return self._step_results(skipped_reward_n)
+
+    # set action for each agent, action_n is either a list of per-agent actions or a (n_agents, act_dim)
+    # array holding the flat action of each agent (see flatten_action), decoded for all agents at once
+    def _set_actions(self, action_n):
         self.agents = [agent for agent in self.world.agents if not agent.always_scripted] # TODO: figure out the consequences of changing that too
-        # set action for each agent
+        if isinstance(action_n, np.ndarray) and action_n.ndim == 2:
+            self._decode_actions(action_n)
+            return
         for i, agent in enumerate(self.agents):
             self._set_action(action_n[i], agent, self.action_space[i])
-        # advance world state
-        self.world.step()
+
+    # precompute the decoding of flat action arrays: each agent's row holds its physical action (if
+    # movable) followed by its communication action (if not silent), with discrete actions given as
+    # one-hot vectors, or as indices when discrete_action_input is set
+    def _make_action_plan(self):
+        dim_p, dim_c = self.world.dim_p, self.world.dim_c
+        movable = np.array([agent.movable for agent in self.agents], dtype=bool)
+        silent = np.array([agent.silent for agent in self.agents], dtype=bool)
+        sensitivity = np.array([5.0 if agent.accel is None else agent.accel for agent in self.agents])
+        # physical action size in the flat vector
+        u_dim = np.where(movable, 1 if self.discrete_action_input else
+                         (dim_p * 2 if self.discrete_action_space else dim_p), 0)
+        c_dim = np.where(silent, 0, 1 if self.discrete_action_input else dim_c)
+        act_dim = int(np.max(u_dim + c_dim)) if len(self.agents) else 0
+        # linear maps from the flat vector to the physical and communication actions
+        u_proj = np.zeros((len(self.agents), act_dim, dim_p))
+        c_proj = np.zeros((len(self.agents), act_dim, dim_c))
+        for i in range(len(self.agents)):
+            if movable[i] and not self.discrete_action_input:
+                if self.discrete_action_space:
+                    u_proj[i, [0, 1, 2, 3], [0, 0, 1, 1]] = [1.0, -1.0, 1.0, -1.0]
+                else:
+                    u_proj[i, np.arange(dim_p), np.arange(dim_p)] = 1.0
+            if not silent[i] and not self.discrete_action_input:
+                c_proj[i, u_dim[i] + np.arange(dim_c), np.arange(dim_c)] = 1.0
+        # physical actions selected by discrete action indices (0 is no-op)
+        u_table = np.zeros((2 * dim_p + 1, dim_p))
+        for d in range(dim_p):
+            u_table[2 * d + 1, d] = -1.0
+            u_table[2 * d + 2, d] = +1.0
+        return {
+            'discrete_input': self.discrete_action_input,
+            'act_dim': act_dim,
+            'movable': movable,
+            'silent': silent,
+            'sensitivity': sensitivity,
+            'u_dim': u_dim,
+            'u_mask': np.arange(act_dim) < u_dim[:, None],
+            'u_proj': u_proj,
+            'c_proj': c_proj,
+            'u_table': u_table,
+            'rows': None,
+            'rows_version': None,
+        }
+
+    # decode a (n_agents, act_dim) action array for all agents at once and write the result into the
+    # world action arrays (same semantics as _set_action)
+    def _decode_actions(self, actions):
+        if self._action_plan['discrete_input'] != self.discrete_action_input:
+            self._action_plan = self._make_action_plan()
+        plan = self._action_plan
+        world = self.world
+        world.sync_arrays()
+        if plan['rows_version'] != world._bound_version:
+            plan['rows'] = np.array([agent.action._index for agent in self.agents], dtype=np.int64)
+            plan['rows_version'] = world._bound_version
+        actions = np.asarray(actions, dtype=float)[:, :plan['act_dim']]
+        movable, silent = plan['movable'], plan['silent']
+        if self.discrete_action_input:
+            u_index = np.where(movable, actions[:, 0], 0).astype(np.int64)
+            u = plan['u_table'][u_index]
+            c = np.zeros((len(actions), world.dim_c))
+            if world.dim_c > 0 and not np.all(silent):
+                speakers = np.flatnonzero(~silent)
+                c[speakers, actions[speakers, plan['u_dim'][speakers]].astype(np.int64)] = 1.0
+        else:
+            if self.force_discrete_action:
+                # keep only the largest physical action component, set to one
+                d = np.argmax(np.where(plan['u_mask'], actions, -np.inf), axis=1)
+                actions = np.where(plan['u_mask'], 0.0, actions)
+                actions[movable, d[movable]] = 1.0
+            u = np.einsum('ij,ijk->ik', actions, plan['u_proj'])
+            c = np.einsum('ij,ijk->ik', actions, plan['c_proj'])
+        # maximum force all the time (see _set_action)
+        u = u / (np.sqrt(np.sum(u**2, axis=1, keepdims=True)) + 1e-8)
+        u *= plan['sensitivity'][:, None]
+        world._action_u[plan['rows']] = u
+        world._action_c[plan['rows']] = c
+
+    # bookkeeping after a world step whose observations are skipped, returns the summed skipped rewards
+    def _skipped_step(self, skipped_reward_n):
+        if self.sum_skipped_rewards:
+            skipped_reward_n = [r + reward for r, reward in zip(skipped_reward_n, self._get_rewards())]
+        if self.post_step_callback is not None:
+            self.post_step_callback(self.world)
+        return skipped_reward_n
+
+    # observations, rewards, dones and infos after the last world step of an env step
+    def _step_results(self, skipped_reward_n):
+        if self.obs_buffer is not None:
+            return self._step_results_preallocated(skipped_reward_n)
+        done_n = []
+        info_n = {'n': []}
         # record observation for each agent
+        obs_n = self._get_observations()
+        reward_n = [reward + skipped_reward for reward, skipped_reward in zip(self._get_rewards(), skipped_reward_n)]
         for agent in self.agents:
-            obs_n.append(self._get_obs(agent))
-            reward_n.append(self._get_reward(agent))
             done_n.append(self._get_done(agent))
-
             info_n['n'].append(self._get_info(agent))
 
         # all agents get total reward in cooperative case
@@ -108,17 +245,104 @@ class MultiAgentEnv(gym.Env):
             self.post_step_callback(self.world)
         return obs_n, reward_n, done_n, info_n
 
+    # same as _step_results, but written into the env's buffers
+    def _step_results_preallocated(self, skipped_reward_n):
+        info_n = {'n': []}
+        self._write_observations()
+        self.reward_buffer[:] = self._get_rewards()
+        self.reward_buffer += skipped_reward_n
+        for i, agent in enumerate(self.agents):
+            self.done_buffer[i] = self._get_done(agent)
+            info_n['n'].append(self._get_info(agent))
+        # all agents get total reward in cooperative case
+        if self.shared_reward:
+            self.reward_buffer[:] = np.sum(self.reward_buffer)
+        if self.post_step_callback is not None:
+            self.post_step_callback(self.world)
+        return self.obs_buffer, self.reward_buffer, self.done_buffer, info_n
+
+    # score K candidate joint actions from the same state without touching the live episode: actions holds
+    # the actions of the agents for each branch, as a (K, n_agents, act_dim) array (see _decode_actions) or
+    # a list of K action_n lists; state is a snapshot from world.get_state (the current state by default).
+    # The branches are stepped together by World.step_branches (a single world step, whatever frame_skip).
+    # Returns the (K, n_agents, obs_dim) observations (zero-padded, see stack_observations), the
+    # (K, n_agents) rewards and dones, and the K world states after the step (to search deeper from them).
+    def evaluate_actions(self, actions, state=None):
+        world = self.world
+        live = world.get_state()
+        if state is not None:
+            world.set_state(state)
+        world.sync_arrays()
+        k = len(actions)
+        action_u = np.zeros((k,) + world._action_u.shape)
+        action_c = np.zeros((k,) + world._action_c.shape)
+        for b in range(k):
+            self._set_actions(actions[b])
+            action_u[b], action_c[b] = world._action_u, world._action_c
+        branches = world.step_branches(action_u, action_c)
+        obs = []
+        rewards = np.zeros((k, len(self.agents)))
+        dones = np.zeros((k, len(self.agents)), dtype=bool)
+        for b, branch in enumerate(branches):
+            world.set_state(branch)
+            obs.append(self._get_observations())
+            rewards[b] = self._get_rewards()
+            dones[b] = [self._get_done(agent) for agent in self.agents]
+        # all agents get total reward in cooperative case
+        if self.shared_reward:
+            rewards[:] = np.sum(rewards, axis=1, keepdims=True)
+        world.set_state(live)
+        return stack_observations(obs), rewards, dones, branches
+
     def _reset(self):
         # reset world
         self.reset_callback(self.world)
+        self.world.clear_step_cache()
         # reset renderer
         self._reset_render()
         # record observations for each agent
-        obs_n = []
         self.agents = [agent for agent in self.world.agents if not agent.always_scripted] # TODO: figure out the consequences of having changed that
-        for agent in self.agents:
-            obs_n.append(self._get_obs(agent))
-        return obs_n
+        if self.obs_buffer is not None:
+            self._write_observations()
+            return self.obs_buffer
+        return self._get_observations()
+
+    # indices in world.agents of the agents of the env
+    def _agent_rows(self):
+        return [i for i, agent in enumerate(self.world.agents) if not agent.always_scripted]
+
+    # whether to use the given vectorized callback instead of its per-agent counterpart
+    def _use_all_callback(self, all_callback, callback):
+        if all_callback is None:
+            return False
+        return callback is None or len(self.agents) >= VECTORIZED_MIN_AGENTS
+
+    # get observations of all agents
+    def _get_observations(self):
+        if not self._use_all_callback(self.observation_all_callback, self.observation_callback):
+            return [self._get_obs(agent) for agent in self.agents]
+        obs_all = self.observation_all_callback(self.world)
+        return [obs_all[i] for i in self._agent_rows()]
+
+    # write the observations of all agents in the preallocated observation buffer
+    def _write_observations(self):
+        if not self._use_all_callback(self.observation_all_callback, self.observation_callback):
+            for i, agent in enumerate(self.agents):
+                self._get_obs(agent, out=self.obs_buffer[i, :self._obs_dims[i]])
+            return
+        obs_all = self.observation_all_callback(self.world)
+        if isinstance(obs_all, np.ndarray):
+            self.obs_buffer[:, :obs_all.shape[1]] = obs_all[self._agent_rows()]
+        else:
+            for i, row in enumerate(self._agent_rows()):
+                self.obs_buffer[i, :self._obs_dims[i]] = obs_all[row]
+
+    # get rewards of all agents
+    def _get_rewards(self):
+        if not self._use_all_callback(self.reward_all_callback, self.reward_callback):
+            return [self._get_reward(agent) for agent in self.agents]
+        rewards = self.reward_all_callback(self.world)
+        return [rewards[i] for i in self._agent_rows()]
 
     # get info used for benchmarking
     def _get_info(self, agent):
@@ -126,11 +350,16 @@ class MultiAgentEnv(gym.Env):
             return {}
         return self.info_callback(agent, self.world)
 
-    # get observation for a particular agent
-    def _get_obs(self, agent):
+    # get observation for a particular agent (written into out if given)
+    def _get_obs(self, agent, out=None):
         if self.observation_callback is None:
             return np.zeros(0)
-        return self.observation_callback(agent, self.world)
+        if out is None:
+            return self.observation_callback(agent, self.world)
+        if self._observation_out:
+            return self.observation_callback(agent, self.world, out=out)
+        out[:] = self.observation_callback(agent, self.world)
+        return out
 
     # get dones for a particular agent
     # unused right now -- agents are allowed to go beyond the viewing screen
@@ -145,10 +374,10 @@ class MultiAgentEnv(gym.Env):
             return 0.0
         return self.reward_callback(agent, self.world)
 
-    # set env action for a particular agent
+    # set env action for a particular agent (u and c are built here and written to the agent once)
     def _set_action(self, action, agent, action_space, time=None):
-        agent.action.u = np.zeros(self.world.dim_p)
-        agent.action.c = np.zeros(self.world.dim_c)
+        u = np.zeros(self.world.dim_p)
+        c = np.zeros(self.world.dim_c)
         # process action
         if isinstance(action_space, spaces.MultiDiscrete):
             act = []
@@ -158,42 +387,44 @@ class MultiAgentEnv(gym.Env):
                 act.append(action[index:(index+s)])
                 index += s
             action = act
+        elif isinstance(action_space, spaces.Tuple):
+            action = list(action)
         else:
             action = [action]
 
         if agent.movable:
             # physical action
             if self.discrete_action_input:
-                agent.action.u = np.zeros(self.world.dim_p)
                 # process discrete action
-                if action[0] == 1: agent.action.u[0] = -1.0
-                if action[0] == 2: agent.action.u[0] = +1.0
-                if action[0] == 3: agent.action.u[1] = -1.0
-                if action[0] == 4: agent.action.u[1] = +1.0
+                if action[0] == 1: u[0] = -1.0
+                if action[0] == 2: u[0] = +1.0
+                if action[0] == 3: u[1] = -1.0
+                if action[0] == 4: u[1] = +1.0
             else:
                 if self.force_discrete_action:
                     d = np.argmax(action[0])
                     action[0][:] = 0.0
                     action[0][d] = 1.0
                 if self.discrete_action_space:
-                    agent.action.u[0] += action[0][-4] - action[0][-3] # WARNING: SPECIAL-TEST discreteVScontinuous action spaces: I have set the indexing to -1, -2 instead of 4, 3 to account for the case where there is no 5th action (the first one) that corresponds to not_moving
-                    agent.action.u[1] += action[0][-2] - action[0][-1] # WARNING: SPECIAL-TEST (same)
+                    u[0] += action[0][-4] - action[0][-3] # WARNING: SPECIAL-TEST discreteVScontinuous action spaces: I have set the indexing to -1, -2 instead of 4, 3 to account for the case where there is no 5th action (the first one) that corresponds to not_moving
+                    u[1] += action[0][-2] - action[0][-1] # WARNING: SPECIAL-TEST (same)
                 else:
-                    agent.action.u = action[0]
+                    u = action[0]
             sensitivity = 5.0
             if agent.accel is not None:
                 sensitivity = agent.accel
-            agent.action.u = agent.action.u / (np.sqrt(np.sum(agent.action.u**2)) + 1e-8)  # WARNING: SPECIAL-TEST discreteVScontinuous action spaces: making sure the norm of the force-action is always 1. (maximum force all the time)
-            agent.action.u *= sensitivity
+            u = u / (np.sqrt(np.sum(u**2)) + 1e-8)  # WARNING: SPECIAL-TEST discreteVScontinuous action spaces: making sure the norm of the force-action is always 1. (maximum force all the time)
+            u *= sensitivity
             action = action[1:]
         if not agent.silent:
             # communication action
             if self.discrete_action_input:
-                agent.action.c = np.zeros(self.world.dim_c)
-                agent.action.c[action[0]] = 1.0
+                c[action[0]] = 1.0
             else:
-                agent.action.c = action[0]
+                c = action[0]
             action = action[1:]
+        agent.action.u = u
+        agent.action.c = c
         # make sure we used all elements of action
         assert len(action) == 0
 
@@ -352,8 +583,20 @@ class MultiAgentEnv(gym.Env):
         return dx
 
 
+# stack the observations of the agents of several environments into a (n_envs, n_agents, obs_dim)
+# array; observations shorter than the longest one are zero-padded at the end
+def stack_observations(obs_batch):
+    obs_dim = max(len(obs) for obs_n in obs_batch for obs in obs_n)
+    stacked = np.zeros((len(obs_batch), len(obs_batch[0]), obs_dim))
+    for b, obs_n in enumerate(obs_batch):
+        for i, obs in enumerate(obs_n):
+            stacked[b, i, :len(obs)] = obs
+    return stacked
+
+
 # vectorized wrapper for a batch of multi-agent environments
 # assumes all environments have the same observation and action space
+# the worlds of all environments are stepped together (see multiagent.core.BatchWorld)
 class BatchMultiAgentEnv(gym.Env):
     metadata = {
         'runtime.vectorized': True,
@@ -362,6 +605,7 @@ class BatchMultiAgentEnv(gym.Env):
 
     def __init__(self, env_batch):
         self.env_batch = env_batch
+        self.world = BatchWorld([env.world for env in env_batch])
 
     @property
     def n(self):
@@ -375,26 +619,45 @@ class BatchMultiAgentEnv(gym.Env):
     def observation_space(self):
         return self.env_batch[0].observation_space
 
-    def _step(self, action_n, time):
-        obs_n = []
-        reward_n = []
-        done_n = []
-        info_n = {'n': []}
+    # set the actions of every agent of every env: either a (n_envs, n_agents, act_dim) array or a
+    # flat list of all agents' actions. The worlds are only stepped by step_wait, which returns
+    # (n_envs, n_agents, obs_dim) observations and (n_envs, n_agents) rewards and dones.
+    def step_async(self, action_n):
         i = 0
-        for env in self.env_batch:
-            obs, reward, done, _ = env.step(action_n[i:(i+env.n)], time)
-            i += env.n
-            obs_n += obs
-            # reward = [r / len(self.env_batch) for r in reward]
-            reward_n += reward
-            done_n += done
-        return obs_n, reward_n, done_n, info_n
+        for b, env in enumerate(self.env_batch):
+            if isinstance(action_n, np.ndarray) and action_n.ndim == 3:
+                env._set_actions(action_n[b])
+            else:
+                env._set_actions(action_n[i:(i+env.n)])
+                i += env.n
+
+    def step_wait(self):
+        # advance all worlds at once (holding the actions for frame_skip world steps)
+        frame_skip = self.env_batch[0].frame_skip
+        skipped_reward_batch = [[0.0] * len(env.agents) for env in self.env_batch]
+        for _ in range(frame_skip - 1):
+            self.world.step()
+            skipped_reward_batch = [env._skipped_step(skipped_reward_n)
+                                    for env, skipped_reward_n in zip(self.env_batch, skipped_reward_batch)]
+        self.world.step()
+        obs_batch = []
+        reward_batch = []
+        done_batch = []
+        info_n = {'n': []}
+        for env, skipped_reward_n in zip(self.env_batch, skipped_reward_batch):
+            obs, reward, done, info = env._step_results(skipped_reward_n)
+            obs_batch.append(obs)
+            reward_batch.append(reward)
+            done_batch.append(done)
+            info_n['n'].append(info['n'])
+        return stack_observations(obs_batch), np.array(reward_batch), np.array(done_batch), info_n
+
+    def _step(self, action_n):
+        self.step_async(action_n)
+        return self.step_wait()
 
     def _reset(self):
-        obs_n = []
-        for env in self.env_batch:
-            obs_n += env.reset()
-        return obs_n
+        return stack_observations([env.reset() for env in self.env_batch])
 
     # render environment
     def _render(self, mode='human', close=True):
@@ -402,3 +665,256 @@ class BatchMultiAgentEnv(gym.Env):
         for env in self.env_batch:
             results_n += env.render(mode, close)
         return results_n
+
+
+# length of the flat vector holding one action of the given action space (discrete actions are one-hot)
+def flat_action_dim(action_space):
+    if isinstance(action_space, spaces.Tuple):
+        return sum(flat_action_dim(space) for space in action_space.spaces)
+    if isinstance(action_space, spaces.MultiDiscrete):
+        return int(np.sum(action_space.high - action_space.low + 1))
+    if isinstance(action_space, spaces.Discrete):
+        return action_space.n
+    return int(np.prod(action_space.shape))
+
+
+# write an action into a flat vector (zero-padded past the end of the action)
+def flatten_action(action, action_space, out):
+    if isinstance(action_space, spaces.Tuple):
+        flat = np.concatenate([np.ravel(a) for a in action])
+    else:
+        flat = np.ravel(action)
+    out[:len(flat)] = flat
+    out[len(flat):] = 0.0
+
+
+# inverse of flatten_action, in the form expected by MultiAgentEnv._set_action
+def unflatten_action(flat, action_space):
+    if isinstance(action_space, spaces.Tuple):
+        action = []
+        index = 0
+        for space in action_space.spaces:
+            dim = flat_action_dim(space)
+            action.append(flat[index:(index+dim)].copy())
+            index += dim
+        return action
+    return flat[:flat_action_dim(action_space)].copy()
+
+
+# worker process of SubprocMultiAgentEnv: steps a group of environments as a BatchMultiAgentEnv,
+# reading the actions from and writing the results into its rows of the shared buffers
+def _subproc_worker(remote, parent_remote, env_fns, start, buffer_specs):
+    parent_remote.close()
+    envs = [env_fn() for env_fn in env_fns]
+    batch_env = BatchMultiAgentEnv(envs)
+    stop = start + len(envs)
+    blocks = {}
+    buffers = {}
+    for key, (name, shape, dtype) in buffer_specs.items():
+        blocks[key] = shared_memory.SharedMemory(name=name)
+        buffers[key] = np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf)[start:stop]
+    obs, reward, done, action = buffers['obs'], buffers['reward'], buffers['done'], buffers['action']
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                obs_batch, reward_batch, done_batch, info_n = batch_env.step(np.array(action))
+                obs[:, :, :obs_batch.shape[2]] = obs_batch
+                reward[:] = reward_batch
+                done[:] = done_batch
+                # only send the infos back when the scenario provides some (benchmark mode)
+                if any(info for info_env in info_n['n'] for info in info_env):
+                    remote.send(info_n['n'])
+                else:
+                    remote.send(None)
+            elif cmd == 'reset':
+                obs_batch = batch_env.reset()
+                obs[:, :, :obs_batch.shape[2]] = obs_batch
+                remote.send(None)
+            elif cmd == 'seed':
+                for b, env in enumerate(envs):
+                    env.seed(data + start + b)
+                remote.send(None)
+            elif cmd == 'close':
+                remote.close()
+                break
+            else:
+                # reply with the error instead of raising it here, the parent would wait forever
+                remote.send(ValueError('Unknown command: %r' % (cmd,)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del obs, reward, done, action, buffers
+        for block in blocks.values():
+            block.close()
+
+
+# vectorized wrapper running groups of multi-agent environments in worker processes
+# env_fns are callables creating the environments (e.g. functools.partial(make_env, 'simple_tag')),
+# they must be picklable unless the 'fork' start method is used
+# assumes all environments have the same observation and action space
+# observations, rewards, dones and actions are exchanged through shared memory buffers, the pipes to
+# the workers only carry a short command per step (and the infos in benchmark mode)
+class SubprocMultiAgentEnv(gym.Env):
+    metadata = {
+        'runtime.vectorized': True,
+        'render.modes' : []
+    }
+    _owns_render = False
+
+    def __init__(self, env_fns, n_workers=None, context=None):
+        self.closed = True
+        self.n_envs = len(env_fns)
+        # build one environment locally to get the spaces and buffer shapes
+        env = env_fns[0]()
+        self.action_space = env.action_space
+        self.observation_space = env.observation_space
+        self.n_agents = env.n
+        self.obs_dim = max(space.shape[0] for space in env.observation_space)
+        self.act_dim = max(flat_action_dim(space) for space in env.action_space)
+        del env
+
+        # shared buffers, (n_envs, n_agents, ...) with observations and actions zero-padded to the largest dim
+        specs = {
+            'obs': ((self.n_envs, self.n_agents, self.obs_dim), np.float64),
+            'reward': ((self.n_envs, self.n_agents), np.float64),
+            'done': ((self.n_envs, self.n_agents), np.bool_),
+            'action': ((self.n_envs, self.n_agents, self.act_dim), np.float64),
+        }
+        self._blocks = {}
+        self._buffers = {}
+        buffer_specs = {}
+        for key, (shape, dtype) in specs.items():
+            nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            self._blocks[key] = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._buffers[key] = np.ndarray(shape, dtype=dtype, buffer=self._blocks[key].buf)
+            self._buffers[key][...] = 0
+            buffer_specs[key] = (self._blocks[key].name, shape, dtype)
+
+        # start the workers, each owning a contiguous group of environments
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        n_workers = max(1, min(n_workers, self.n_envs))
+        ctx = multiprocessing.get_context(context)
+        self.remotes = []
+        self.processes = []
+        self._groups = np.array_split(np.arange(self.n_envs), n_workers)
+        for group in self._groups:
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=_subproc_worker,
+                                  args=(work_remote, remote, [env_fns[b] for b in group], int(group[0]), buffer_specs))
+            process.daemon = True
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self._waiting = [False] * n_workers
+        # for double-buffering the workers are split in two halves: the policy computes the actions of
+        # one half while the other half simulates (see step_async)
+        half_workers = (n_workers + 1) // 2
+        self._half_workers = [range(0, half_workers), range(half_workers, n_workers)]
+        self.half_slices = [slice(0, int(self._groups[half_workers - 1][-1]) + 1),
+                            slice(int(self._groups[half_workers - 1][-1]) + 1, self.n_envs)]
+        self.closed = False
+
+    @property
+    def n(self):
+        return self.n_envs * self.n_agents
+
+    def _half(self, half):
+        if half is None:
+            return range(len(self.remotes)), slice(0, self.n_envs)
+        assert len(self.remotes) > 1, 'double-buffering needs at least two workers'
+        return self._half_workers[half], self.half_slices[half]
+
+    # reply of worker w, re-raising the errors sent back by the worker
+    def _recv(self, w):
+        reply = self.remotes[w].recv()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def _write_actions(self, action_n, env_slice):
+        action = self._buffers['action'][env_slice]
+        if isinstance(action_n, np.ndarray) and action_n.ndim == 3:
+            action[:, :, :action_n.shape[2]] = action_n
+            return
+        # flat list of all agents' actions
+        for b in range(len(action)):
+            for i, action_space in enumerate(self.action_space):
+                flatten_action(action_n[b * self.n_agents + i], action_space, action[b, i])
+
+    # start stepping the environments without waiting for the results. action_n holds the actions of
+    # every agent of every env: either a (n_envs, n_agents, act_dim) array or a flat list of all
+    # agents' actions. With half=0 or 1 only that half of the batch (self.half_slices[half]) is
+    # stepped and action_n only covers its envs; the halves can then be stepped alternately:
+    #     env.step_async(act(obs[env.half_slices[1]]), half=1)
+    #     obs_0, reward_0, done_0, info_0 = env.step_wait(half=0)
+    #     env.step_async(act(obs_0), half=0)
+    #     obs_1, reward_1, done_1, info_1 = env.step_wait(half=1)
+    #     ...
+    def step_async(self, action_n, half=None):
+        workers, env_slice = self._half(half)
+        assert not any(self._waiting[w] for w in workers), 'step_async called while a step is in progress'
+        self._write_actions(action_n, env_slice)
+        for w in workers:
+            self.remotes[w].send(('step', None))
+            self._waiting[w] = True
+
+    # wait for the step started by step_async (with the same half), returns (n_envs, n_agents, obs_dim)
+    # observations and (n_envs, n_agents) rewards and dones of the stepped envs
+    def step_wait(self, half=None):
+        workers, env_slice = self._half(half)
+        assert all(self._waiting[w] for w in workers), 'step_wait called without a matching step_async'
+        info_n = {'n': []}
+        for w in workers:
+            self._waiting[w] = False
+            info = self._recv(w)
+            info_n['n'] += info if info is not None else [[{}] * self.n_agents for _ in self._groups[w]]
+        return (self._buffers['obs'][env_slice].copy(), self._buffers['reward'][env_slice].copy(),
+                self._buffers['done'][env_slice].copy(), info_n)
+
+    def _step(self, action_n):
+        self.step_async(action_n)
+        return self.step_wait()
+
+    # wait for the steps still in progress and drop their results (before a reset, seed or close)
+    def _drain(self):
+        for w, remote in enumerate(self.remotes):
+            if self._waiting[w]:
+                self._waiting[w] = False
+                remote.recv()
+
+    def _reset(self):
+        self._drain()
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for w in range(len(self.remotes)):
+            self._recv(w)
+        return self._buffers['obs'].copy()
+
+    # environment b of the batch is seeded with seed + b
+    def _seed(self, seed=None):
+        if seed is None:
+            seed = 1
+        self._drain()
+        for remote in self.remotes:
+            remote.send(('seed', seed))
+        for w in range(len(self.remotes)):
+            self._recv(w)
+
+    def _close(self):
+        if self.closed:
+            return
+        self._drain()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        for remote in self.remotes:
+            remote.close()
+        self._buffers = {}
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self.closed = True
@@ -1,16 +1,56 @@
-from queue import Queue
+import hashlib
+import os
 import numpy as np
 from numpy import sin, cos
-import scipy.integrate as integrate
-from pyglet.window import key
 from multiagent.core import Action
 
 # individual agent policy
 class Policy(object):
+    # names of the attributes that action_all depends on, besides the positions and the roles (adversary) of
+    # the agents: policies setting it are batchable, the policies of the same type and attribute values of a
+    # batch of worlds being computed with a single call (see multiagent.core.BatchWorld.set_scripted_actions)
+    batch_attributes = None
+
     def __init__(self):
         pass
     def action(self, *args):
         raise NotImplementedError()
+    # state that the policy changes as it acts (None for stateless policies), saved and restored along with the
+    # state of the world its agents are in (see multiagent.core.World.get_state)
+    def get_state(self):
+        return None
+    def set_state(self, state):
+        pass
+    # scripted policies can also define action_all(agents, world, p_pos=None), returning the (n, dim_p)
+    # physical actions of all the given agents (those whose action_callback is this policy's action), used by
+    # World.step instead of calling action once per agent. p_pos, if given, replaces world.p_pos and can have
+    # leading batch dimensions (for a batch of worlds with the same agents), which the result then has too.
+    # action_all is only used if it is defined by the same class as action: subclasses overriding action alone
+    # are called once per agent.
+
+# clip forces of shape (..., dim_p) to a norm of max_force (same rule as RunnerPolicy.action)
+def clip_forces(forces, max_force):
+    norm = np.sqrt(np.sum(forces ** 2, axis=-1, keepdims=True))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norm < max_force, forces, max_force * (forces / norm))
+
+# forces pulling the agents at rows of p_pos (..., n_entities, dim_p) towards the entities at targets, inversely
+# proportional to the square of their distance, for all agents in one broadcast (same math as
+# RunnerPolicy.action / RusherPolicy.action); an agent is not its own target. Returns (..., len(rows), dim_p)
+def attraction_forces(p_pos, rows, targets, epsilon=1e-5):
+    force_vec = p_pos[..., None, targets, :] - p_pos[..., rows, None, :]
+    force_norm = np.sqrt(np.sum(np.square(force_vec), axis=-1, keepdims=True))
+    forces = (force_vec * (1. + epsilon)) / (force_norm + epsilon) ** 3
+    others = (rows[:, None] != targets[None, :])[..., None]
+    return np.sum(np.where(others, forces, 0.), axis=-2)
+
+# forces pushing the agents at rows of p_pos (..., n_entities, 2) away from the borders of the environment
+# (same math as RunnerPolicy.action)
+def border_forces(p_pos, rows, epsilon=1e-5):
+    pos = p_pos[..., rows, :]
+    d_high = pos - (1. + epsilon)
+    d_low = pos + (1. + epsilon)
+    return np.sign(d_high) / (d_high + epsilon) ** 2 + np.sign(d_low) / (d_low + epsilon) ** 2
 
 # interactive policy based on keyboard input
 # hard-coded to deal only with movement, not communication
@@ -47,13 +87,15 @@ class InteractivePolicy(Policy):
         action.u = u
         return action
 
-    # keyboard event callbacks
+    # keyboard event callbacks (pyglet is only imported once a window sends key events)
     def key_press(self, k, mod):
+        from pyglet.window import key
         if k==key.RIGHT:  self.move[0] = True
         if k==key.LEFT: self.move[1] = True
         if k==key.DOWN:    self.move[2] = True
         if k==key.UP:  self.move[3] = True
     def key_release(self, k, mod):
+        from pyglet.window import key
         if k==key.RIGHT:  self.move[0] = False
         if k==key.LEFT: self.move[1] = False
         if k==key.DOWN:    self.move[2] = False
@@ -67,6 +109,8 @@ class RunnerPolicy(Policy):
     Driven by repulsive forces inversely proportional to its distance with those entities.
     Only creates movement action, not communication.
     """
+    batch_attributes = ('max_force',)
+
     def __init__(self, max_force=1.):
         self.max_force = max_force
         super(RunnerPolicy, self).__init__()
@@ -105,6 +149,15 @@ class RunnerPolicy(Policy):
 
         return action
 
+    # actions of all runners at once: repulsion from the adversaries and the borders
+    def action_all(self, agents, world, p_pos=None):
+        if p_pos is None:
+            p_pos = world.p_pos
+        rows = np.array([agent.state._index for agent in agents], dtype=np.int64)
+        adversaries = np.array([other.state._index for other in world.agents if other.adversary], dtype=np.int64)
+        forces = border_forces(p_pos, rows) - attraction_forces(p_pos, rows, adversaries)
+        return clip_forces(forces, self.max_force)
+
 
 class RusherPolicy(Policy):
     """
@@ -113,6 +166,8 @@ class RusherPolicy(Policy):
     Driven by attractive forces proportional to its distance with the prey(s).
     Only creates movement action, not communication.
     """
+    batch_attributes = ('max_force',)
+
     def __init__(self, max_force=1.):
         self.max_force = max_force
         super(RusherPolicy, self).__init__()
@@ -139,6 +194,14 @@ class RusherPolicy(Policy):
 
         return action
 
+    # actions of all rushers at once: attraction towards the good agents
+    def action_all(self, agents, world, p_pos=None):
+        if p_pos is None:
+            p_pos = world.p_pos
+        rows = np.array([agent.state._index for agent in agents], dtype=np.int64)
+        targets = np.array([other.state._index for other in world.agents if not other.adversary], dtype=np.int64)
+        return clip_forces(attraction_forces(p_pos, rows, targets), self.max_force)
+
 
 class DoublePendulumPolicy(Policy):
     """
@@ -149,7 +212,8 @@ class DoublePendulumPolicy(Policy):
     Restricted to movement action: no communication.
     """
     def __init__(self, length1=1., length2=1., mass1=1., mass2=1., gravity=3.,
-                 init_th1=120., init_th2=-10., init_w1=100., init_w2=-50., time_step=0.05, time_end=100):
+                 init_th1=120., init_th2=-10., init_w1=100., init_w2=-50., time_step=0.05, time_end=100,
+                 on_end='wrap', cache_dir=None):
         super(DoublePendulumPolicy, self).__init__()
 
         # Physical properties
@@ -169,24 +233,66 @@ class DoublePendulumPolicy(Policy):
         self.time_step = time_step
         self.time_end = time_end
 
+        # What to do once the trajectory has been followed to its end: 'wrap' follows it again from the
+        # start, 'regenerate' simulates the next stretch of the pendulum's motion from where it ended
+        if on_end not in ('wrap', 'regenerate'):
+            raise ValueError('Unknown on_end policy: %s' % on_end)
+        self.on_end = on_end
+        # Directory where the trajectory is cached on disk and shared between processes (None: no disk cache)
+        self.cache_dir = cache_dir
+
         self.precompute_actions()
 
     def precompute_actions(self):
-        # Runs a simulation and keep it in memory
-        # The trajectory given by the simulation will be followed step by step
-        vx1, vx2, vy1, vy2 = self.simulate()
-        self.vshifts = np.vstack(self.convert_trajectory_to_forces(vx2, vy2)).T
-        self.precomputed_actions = Queue()
-        for vshift in self.vshifts:
-            self.precomputed_actions.put(vshift)
+        # Gets the trajectory of the simulation (shared by all policies with the same parameters)
+        # The trajectory given by the simulation will be followed step by step, from the index cursor
+        self.vshifts, self.end_state = self.load_trajectory()
+        self.cursor = 0
+
+    # read-only (n_steps - 1, 2) velocity shifts of the trajectory starting from the initial conditions and
+    # the state it ends in, memoized in this process and, if cache_dir is set, on disk (where they are
+    # memory-mapped, so that workers on the same machine share them), keyed by the initial state actually
+    # integrated and the physical and time parameters
+    def load_trajectory(self):
+        init_state = self.initial_state()
+        key = (tuple(init_state.tolist()), self.length1, self.length2, self.mass1, self.mass2, self.gravity,
+               self.time_step, self.time_end)
+        trajectory = _pendulum_trajectories.get(key)
+        if trajectory is not None:
+            return trajectory
+        path = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, 'double_pendulum_%s' % hashlib.sha1(repr(key).encode()).hexdigest())
+            try:
+                trajectory = np.load(path + '.npy', mmap_mode='r'), np.load(path + '_end.npy')
+            except (IOError, ValueError):
+                trajectory = None
+        if trajectory is None:
+            trajectory = self.compute_trajectory(init_state)
+            if path is not None:
+                trajectory = _save_trajectory(path, *trajectory)
+        for array in trajectory:
+            array.flags.writeable = False
+        _pendulum_trajectories[key] = trajectory
+        return trajectory
+
+    # velocity shifts of the trajectory starting from init_state and the state it ends in
+    def compute_trajectory(self, init_state):
+        y = self.integrate(init_state)
+        vx1, vx2, vy1, vy2 = self.trajectory_velocities(y)
+        return np.vstack(self.convert_trajectory_to_forces(vx2, vy2)).T, y[-1].copy()
+
+    # state of the pendulum the trajectory starts from
+    def initial_state(self):
+        return np.radians([self.init_th1, self.init_th1, self.init_w1, self.init_w2])
 
     def simulate(self):
+        return self.trajectory_velocities(self.integrate(self.initial_state()))
+
+    def integrate(self, init_state):
         # create a time array from 0..100 sampled at 0.05 second steps
         t = np.arange(0.0, self.time_end, self.time_step)
 
-        # initial state
-        init_state = np.radians([self.init_th1, self.init_th1, self.init_w1, self.init_w2])
-
         def derivs(state, t):
             dydx = np.zeros_like(state)
             dydx[0] = state[1]
@@ -208,9 +314,11 @@ class DoublePendulumPolicy(Policy):
 
             return dydx
 
-        # integrate the ODE using scipy.integrate.
-        y = integrate.odeint(derivs, init_state, t)
+        # integrate the ODE using scipy.integrate (imported here, only pendulum policies need scipy)
+        import scipy.integrate as integrate
+        return integrate.odeint(derivs, init_state, t)
 
+    def trajectory_velocities(self, y):
         # converts the angular velocities to cartesian velocities
         vx1 = self.length1 * sin(y[:, 1])
         vy1 = -self.length1 * cos(y[:, 1])
@@ -226,7 +334,38 @@ class DoublePendulumPolicy(Policy):
 
         return x_shifts, y_shifts
 
+    # position along the trajectory, and the trajectory itself (replaced when regenerated)
+    def get_state(self):
+        return self.cursor, self.vshifts, self.end_state
+
+    def set_state(self, state):
+        self.cursor, self.vshifts, self.end_state = state
+
     def action(self, agent, world):
+        if self.cursor == len(self.vshifts):
+            if self.on_end == 'regenerate':
+                # continuations are specific to this policy and not cached: they replace its own buffer
+                self.vshifts, self.end_state = self.compute_trajectory(self.end_state)
+            self.cursor = 0
         action = Action()
-        action.u = 100 * self.precomputed_actions.get()
+        action.u = 100 * self.vshifts[self.cursor]
+        self.cursor += 1
         return action
+
+
+# initial trajectories of DoublePendulumPolicy, memoized by parameters (see DoublePendulumPolicy.load_trajectory)
+_pendulum_trajectories = {}
+
+# write a trajectory to the disk cache (through temporary files renamed in place, so that concurrent workers
+# never read partial files) and return it memory-mapped; kept in memory if the cache cannot be written
+def _save_trajectory(path, vshifts, end_state):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for suffix, array in (('_end.npy', end_state), ('.npy', vshifts)):
+            tmp_path = '%s.%d.tmp' % (path + suffix, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path + suffix)
+        return np.load(path + '.npy', mmap_mode='r'), end_state
+    except (IOError, OSError):
+        return vshifts, end_state
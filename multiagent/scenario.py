@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 
 # defines scenario upon which the world is built
@@ -12,3 +13,59 @@ class BaseScenario(object):
     # (e.g. to keep track of time, change landmark positions, etc.)
     def post_step(self, world):
         pass
+    # scenarios can also define vectorized versions of reward(agent, world) and observation(agent, world),
+    # used by the environment instead of calling those once per agent:
+    # reward_all(world) returns the rewards of all agents in world.agents as an (n_agents,) array
+    # observation_all(world) returns their observations, as an (n_agents, obs_dim) array or as a list of
+    # 1-D arrays when the observation size differs between agents
+
+# memoize a scenario helper (e.g. is_collision(agent1, agent2) or good_agents(world)) until the world
+# changes: the result is stored in world.step_cache, keyed on the helper and its arguments, and recomputed
+# after the next World.step, environment reset or position assignment. The world is found among the
+# arguments, directly or through the entities bound to it. Only use it for helpers without side effects.
+def step_cached(method):
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        world = None
+        for arg in args:
+            world = arg if hasattr(arg, 'step_cache') else getattr(arg, '_world', None)
+            if world is not None:
+                break
+        if world is None:
+            return method(self, *args)
+        key = (method.__name__, self) + args
+        try:
+            return world.step_cache[key]
+        except KeyError:
+            value = world.step_cache[key] = method(self, *args)
+            return value
+        except TypeError:
+            # unhashable arguments
+            return method(self, *args)
+    return wrapper
+
+# helpers for vectorized scenario callbacks
+
+# distances between each row of pos_a (n, dim_p) and each row of pos_b (m, dim_p), as an (n, m) array
+def pairwise_distances(pos_a, pos_b):
+    return np.sqrt(np.sum(np.square(pos_a[:, None, :] - pos_b[None, :, :]), axis=-1))
+
+# for each of the n rows of values, the other n - 1 rows in order: (n, n - 1, ...)
+def other_rows(values):
+    return values[_other_indices(len(values))]
+
+# (n, n - 1) indices of the other rows of each row
+@functools.lru_cache(maxsize=None)
+def _other_indices(n):
+    others = np.arange(n - 1) + (np.arange(n - 1)[None, :] >= np.arange(n)[:, None])
+    others.setflags(write=False)
+    return others
+
+# gather observations computed per group of agents into one list ordered like world.agents;
+# groups is a list of (agent indices, (n_group, obs_dim) observations) pairs
+def merge_observations(n_agents, groups):
+    obs_n = [None] * n_agents
+    for indices, obs in groups:
+        for i, o in zip(indices, obs):
+            obs_n[i] = o
+    return obs_n
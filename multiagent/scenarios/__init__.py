@@ -1,7 +1,78 @@
-import imp
+import importlib
+import importlib.util
+import os
 import os.path as osp
+import zlib
 
+# installed packages can provide scenario modules under this entry point group, e.g. in their setup.py:
+# entry_points={'multiagent.scenarios': ['my_scenario = my_package.my_scenario']}
+ENTRY_POINT_GROUP = 'multiagent.scenarios'
 
+# loaded scenario modules, by the name they were loaded with and by file path (or entry point)
+_modules = {}
+
+
+# load a scenario module, given the file name of one of the scenarios of this folder (with or without
+# '.py'), the path to a scenario file, or the name of a scenario entry point. Modules are loaded once
+# per process and cached: scenarios of this folder are imported as multiagent.scenarios.<name> (using
+# the bytecode cache), other files under their own module name.
 def load(name):
-    pathname = osp.join(osp.dirname(__file__), name)
-    return imp.load_source('', pathname)
+    module = _modules.get(name)
+    if module is None:
+        key, module_name, path = _resolve(name)
+        module = _modules.get(key)
+        if module is None:
+            if path is None:
+                module = _load_entry_point(module_name)
+            elif module_name is not None:
+                module = importlib.import_module(module_name)
+            else:
+                module = _load_file(path)
+            _modules[key] = module
+        _modules[name] = module
+    return module
+
+
+# load all the scenarios of this folder (and of the entry points, if asked for), e.g. in a fork-server
+# or pool parent process so that workers do not import them again; returns them by name
+def load_all(entry_points=False):
+    names = [osp.splitext(f)[0] for f in os.listdir(osp.dirname(__file__))
+             if f.endswith('.py') and not f.startswith('_')]
+    if entry_points:
+        names += [ep.name for ep in _entry_points() if ep.name not in names]
+    return {name: load(name) for name in sorted(names)}
+
+
+# cache key, module name of scenarios of this folder and file path (None for entry points) of a scenario
+def _resolve(name):
+    folder = osp.dirname(osp.abspath(__file__))
+    path = osp.join(folder, name)
+    if not osp.isfile(path) and osp.isfile(path + '.py'):
+        path = path + '.py'
+    if osp.isfile(path):
+        path = osp.realpath(path)
+        if osp.dirname(path) == osp.realpath(folder):
+            return path, __name__ + '.' + osp.splitext(osp.basename(path))[0], path
+        return path, None, path
+    return ('entry point', name), osp.splitext(name)[0], None
+
+def _load_file(path):
+    module_name = 'multiagent_scenario_%s_%x' % (osp.splitext(osp.basename(path))[0], zlib.crc32(path.encode()))
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _entry_points():
+    import importlib.metadata
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return entry_points.select(group=ENTRY_POINT_GROUP)
+    return entry_points.get(ENTRY_POINT_GROUP, [])
+
+def _load_entry_point(name):
+    for ep in _entry_points():
+        if ep.name == name:
+            return ep.load()
+    raise ValueError('Unknown scenario: %s (not a file in %s nor a %s entry point)' %
+                     (name, osp.dirname(__file__), ENTRY_POINT_GROUP))
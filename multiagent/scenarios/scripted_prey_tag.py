@@ -1,7 +1,7 @@
 # CODE TAKEN FROM multiagent.scenarios.simple_tag.py
 import numpy as np
 from multiagent.core import World, Agent, Landmark, Wall
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, pairwise_distances, other_rows, merge_observations, step_cached
 from multiagent.policy import RunnerPolicy
 
 
@@ -89,13 +89,14 @@ class Scenario(BaseScenario):
         if agent.adversary:
             collisions = 0
             for a in self.good_agents(world):
-                if self.is_collision(a, agent):
+                if world.in_contact(a, agent):
                     collisions += 1
             return collisions
         else:
             return 0
 
 
+    @step_cached
     def is_collision(self, agent1, agent2):
         delta_pos = agent1.state.p_pos - agent2.state.p_pos
         dist = np.sqrt(np.sum(np.square(delta_pos)))
@@ -103,10 +104,12 @@ class Scenario(BaseScenario):
         return True if dist < dist_min else False
 
     # return all agents that are not adversaries
+    @step_cached
     def good_agents(self, world):
         return [agent for agent in world.agents if not agent.adversary]
 
     # return all adversarial agents
+    @step_cached
     def adversaries(self, world):
         return [agent for agent in world.agents if agent.adversary]
 
@@ -157,7 +160,7 @@ class Scenario(BaseScenario):
                         rew += 10
         return rew
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
         for entity in world.landmarks:
@@ -181,4 +184,43 @@ class Scenario(BaseScenario):
             other_pos.append(other.state.p_pos - agent.state.p_pos)
             if not other.adversary:
                 other_vel.append(other.state.p_vel)
-        return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel + wall_pos)
+        return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel + wall_pos, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        agent_pos = world.p_pos[world.agent_indices]
+        size = world.entity_size[world.agent_indices]
+        adversary = np.array([agent.adversary for agent in world.agents], dtype=bool)
+        collide = np.array([agent.collide for agent in world.agents], dtype=bool)
+        # distances and collisions between good agents (rows) and adversaries (columns)
+        dist = pairwise_distances(agent_pos[~adversary], agent_pos[adversary])
+        collisions = dist < size[~adversary][:, None] + size[adversary][None, :]
+        rew = np.zeros(len(agent_pos))
+        # good agents (see agent_reward)
+        rew[~adversary] = 0.1 * np.sum(dist, axis=1) - 10 * np.sum(collisions, axis=1) * collide[~adversary]
+        # adversaries (see adversary_reward)
+        rew[adversary] = -0.1 * np.sum(np.min(dist, axis=0)) + 10 * np.sum(collisions) * collide[adversary]
+        return rew
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        agent_vel = world.p_vel[world.agent_indices]
+        adversaries = np.flatnonzero([agent.adversary for agent in world.agents])
+        good_agents = np.flatnonzero([not agent.adversary for agent in world.agents])
+        landmarks = [i for i, landmark in zip(world.landmark_indices, world.landmarks) if not landmark.boundary]
+        entity_pos = world.p_pos[landmarks][None, :, :] - agent_pos[:, None, :]
+        other_pos = other_rows(agent_pos) - agent_pos[:, None, :]
+        obs = np.concatenate([agent_vel, agent_pos, entity_pos.reshape(n, -1), other_pos.reshape(n, -1)], axis=1)
+        # velocities of the other good agents
+        good_vel = agent_vel[good_agents]
+        adversary_obs = [obs[adversaries], np.broadcast_to(good_vel.reshape(1, -1), (len(adversaries), good_vel.size))]
+        good_obs = [obs[good_agents], other_rows(good_vel).reshape(len(good_agents), -1)]
+        # relative positions to the walls
+        wall_dims = [1 if wall.orient == 'H' else 0 for wall in world.walls if wall.orient in ('H', 'V')]
+        wall_axis = np.array([wall.axis_pos for wall in world.walls if wall.orient in ('H', 'V')])
+        wall_pos = agent_pos[:, wall_dims] - wall_axis[None, :]
+        adversary_obs.append(wall_pos[adversaries])
+        good_obs.append(wall_pos[good_agents])
+        return merge_observations(n, [(adversaries, np.concatenate(adversary_obs, axis=1)),
+                                      (good_agents, np.concatenate(good_obs, axis=1))])
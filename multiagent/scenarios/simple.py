@@ -42,9 +42,19 @@ class Scenario(BaseScenario):
         dist2 = np.sum(np.square(agent.state.p_pos - world.landmarks[0].state.p_pos))
         return -dist2 #np.exp(-dist2)
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
         for entity in world.landmarks:
             entity_pos.append(entity.state.p_pos - agent.state.p_pos)
-        return np.concatenate([agent.state.p_vel] + entity_pos)
+        return np.concatenate([agent.state.p_vel] + entity_pos, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        agent_pos = world.p_pos[world.agent_indices]
+        return -np.sum(np.square(agent_pos - world.landmarks[0].state.p_pos), axis=1)
+
+    def observation_all(self, world):
+        agent_pos = world.p_pos[world.agent_indices]
+        entity_pos = world.p_pos[world.landmark_indices][None, :, :] - agent_pos[:, None, :]
+        return np.concatenate([world.p_vel[world.agent_indices], entity_pos.reshape(len(agent_pos), -1)], axis=1)
@@ -1,6 +1,6 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, other_rows, merge_observations, step_cached
 import random
 
 
@@ -8,6 +8,8 @@ class Scenario(BaseScenario):
 
     def make_world(self):
         world = World()
+        # goals and colors chosen at reset are part of the state saved by world.get_state
+        world.state_attributes = ['goal_a', 'color']
         # set any world properties first
         world.dim_c = 2
         num_agents = 3
@@ -67,10 +69,12 @@ class Scenario(BaseScenario):
             return tuple(dists)
 
     # return all agents that are not adversaries
+    @step_cached
     def good_agents(self, world):
         return [agent for agent in world.agents if not agent.adversary]
 
     # return all adversarial agents
+    @step_cached
     def adversaries(self, world):
         return [agent for agent in world.agents if agent.adversary]
 
@@ -119,7 +123,7 @@ class Scenario(BaseScenario):
             return adv_rew
 
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
         for entity in world.landmarks:
@@ -135,6 +139,32 @@ class Scenario(BaseScenario):
             other_pos.append(other.state.p_pos - agent.state.p_pos)
 
         if not agent.adversary:
-            return np.concatenate([agent.goal_a.state.p_pos - agent.state.p_pos] + entity_pos + other_pos)
+            return np.concatenate([agent.goal_a.state.p_pos - agent.state.p_pos] + entity_pos + other_pos, out=out)
         else:
-            return np.concatenate(entity_pos + other_pos)
+            return np.concatenate(entity_pos + other_pos, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        agent_pos = world.p_pos[world.agent_indices]
+        adversary = np.array([agent.adversary for agent in world.agents], dtype=bool)
+        goal_delta = agent_pos - np.array([agent.goal_a.state.p_pos for agent in world.agents])
+        goal_dist = np.sqrt(np.sum(np.square(goal_delta), axis=1))
+        rew = np.zeros(len(agent_pos))
+        # good agents (see agent_reward)
+        rew[~adversary] = -np.min(goal_dist[~adversary]) + np.sum(goal_dist[adversary])
+        # adversaries (see adversary_reward)
+        rew[adversary] = -np.sum(np.square(goal_delta[adversary]), axis=1)
+        return rew
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        adversaries = np.flatnonzero([agent.adversary for agent in world.agents])
+        good_agents = np.flatnonzero([not agent.adversary for agent in world.agents])
+        entity_pos = world.p_pos[world.landmark_indices][None, :, :] - agent_pos[:, None, :]
+        other_pos = other_rows(agent_pos) - agent_pos[:, None, :]
+        obs = np.concatenate([entity_pos.reshape(n, -1), other_pos.reshape(n, -1)], axis=1)
+        goal_pos = np.array([world.agents[i].goal_a.state.p_pos for i in good_agents]).reshape(len(good_agents), -1)
+        return merge_observations(n, [(adversaries, obs[adversaries]),
+                                      (good_agents, np.concatenate([goal_pos - agent_pos[good_agents],
+                                                                    obs[good_agents]], axis=1))])
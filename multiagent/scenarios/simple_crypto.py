@@ -7,7 +7,7 @@ adversary to goal. Adversary is rewarded for its distance to the goal.
 
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, merge_observations, step_cached
 import random
 
 
@@ -20,6 +20,8 @@ class Scenario(BaseScenario):
 
     def make_world(self):
         world = World()
+        # goals and colors chosen at reset are part of the state saved by world.get_state
+        world.state_attributes = ['goal_a', 'key', 'color']
         # set any world properties first
         num_agents = 3
         num_adversaries = 1
@@ -80,14 +82,17 @@ class Scenario(BaseScenario):
         return (agent.state.c, agent.goal_a.color)
 
     # return all agents that are not adversaries
+    @step_cached
     def good_listeners(self, world):
         return [agent for agent in world.agents if not agent.adversary and not agent.speaker]
 
     # return all agents that are not adversaries
+    @step_cached
     def good_agents(self, world):
         return [agent for agent in world.agents if not agent.adversary]
 
     # return all adversarial agents
+    @step_cached
     def adversaries(self, world):
         return [agent for agent in world.agents if agent.adversary]
 
@@ -121,7 +126,7 @@ class Scenario(BaseScenario):
         return rew
 
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # goal color
         goal_color = np.zeros(world.dim_color)
         if agent.goal_a is not None:
@@ -155,17 +160,52 @@ class Scenario(BaseScenario):
                 print('speaker')
                 print(agent.state.c)
                 print(np.concatenate([goal_color] + [key] + [confer] + [np.random.randn(1)]))
-            return np.concatenate([goal_color] + [key])
+            return np.concatenate([goal_color] + [key], out=out)
         # listener
         if not agent.speaker and not agent.adversary:
             if prnt:
                 print('listener')
                 print(agent.state.c)
                 print(np.concatenate([key] + comm + [confer]))
-            return np.concatenate([key] + comm)
+            return np.concatenate([key] + comm, out=out)
         if not agent.speaker and agent.adversary:
             if prnt:
                 print('adversary')
                 print(agent.state.c)
                 print(np.concatenate(comm + [confer]))
-            return np.concatenate(comm)
+            return np.concatenate(comm, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        adversary = np.array([agent.adversary for agent in world.agents], dtype=bool)
+        good_listener = np.array([not agent.adversary and not agent.speaker for agent in world.agents], dtype=bool)
+        comm = np.array([agent.state.c for agent in world.agents])
+        goal_color = np.array([agent.goal_a.color for agent in world.agents])
+        # squared error of each agent's utterance to the goal of every agent (rows: goal owner), zero when
+        # nothing was said
+        spoke = np.any(comm != 0, axis=1)
+        error = np.sum(np.square(comm[None, :, :] - goal_color[:, None, :]), axis=2) * spoke[None, :]
+        # good agents (see agent_reward) and adversaries (see adversary_reward)
+        good_rew = np.sum(error[:, adversary], axis=1) - np.sum(error[:, good_listener], axis=1)
+        return np.where(adversary, -np.diagonal(error), good_rew)
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        speakers = np.flatnonzero([agent.speaker for agent in world.agents])
+        listeners = np.flatnonzero([not agent.speaker and not agent.adversary for agent in world.agents])
+        adversaries = np.flatnonzero([not agent.speaker and agent.adversary for agent in world.agents])
+        if world.agents[2].key is None:
+            key = np.zeros(world.dim_c)
+            goal_color = np.zeros((len(speakers), world.dim_c))
+        else:
+            key = world.agents[2].key
+            goal_color = np.array([world.agents[i].goal_a.color if world.agents[i].goal_a is not None
+                                   else np.zeros(world.dim_color) for i in speakers]).reshape(len(speakers), -1)
+        # communication of the speakers, as seen by any other agent
+        speaker_comm = [world.agents[i].state.c for i in speakers if world.agents[i].state.c is not None]
+        comm = np.concatenate(speaker_comm) if speaker_comm else np.zeros(0)
+        return merge_observations(n, [
+            (speakers, np.concatenate([goal_color, np.tile(key, (len(speakers), 1))], axis=1)),
+            (listeners, np.tile(np.concatenate([key, comm]), (len(listeners), 1))),
+            (adversaries, np.tile(comm, (len(adversaries), 1))),
+        ])
@@ -1,11 +1,13 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, pairwise_distances, other_rows
 
 
 class Scenario(BaseScenario):
     def make_world(self, n_agents=5):
         world = World()
+        # collision flags and colors updated by the rewards are part of the state saved by world.get_state
+        world.state_attributes = ['is_colliding', 'color']
         # set any world properties first
         world.clip_positions = True
         world.dim_c = 0
@@ -112,7 +114,7 @@ class Scenario(BaseScenario):
 
         return rew
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
         for entity in world.landmarks:  # world.entities:
@@ -124,4 +126,36 @@ class Scenario(BaseScenario):
                 continue
             else:
                 other_pos.append(other_agent.state.p_pos - agent.state.p_pos)
-        return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos)
+        return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        landmark_pos = world.p_pos[world.landmark_indices]
+        rew = np.full(n, -np.sum(pairwise_distances(landmark_pos, agent_pos)))
+        # collisions between distinct colliding agents (see is_collision)
+        agents = world.agent_indices
+        collide = np.array([agent.collide for agent in world.agents], dtype=bool)
+        collisions = world.contact_adjacency()[np.ix_(agents, agents)] & collide[:, None] & collide[None, :]
+        # update the collision flags and colors as count_collisions does
+        names = [agent.name for agent in world.agents]
+        for i, agent in enumerate(world.agents):
+            if agent.collide:
+                agent.is_colliding.update((names[j], c) for j, c in enumerate(collisions[i].tolist())
+                                          if collide[j] and j != i)
+        for agent in world.agents:
+            if agent.collide:
+                if any(agent.is_colliding.values()):
+                    agent.color = np.array([0.27, 0.44, 0.55])
+                else:
+                    agent.color = np.array([0.54, 0.82, 0.98])
+        return rew - np.where(collide, np.sum(collisions, axis=1), 0)
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        entity_pos = world.p_pos[world.landmark_indices][None, :, :] - agent_pos[:, None, :]
+        other_pos = other_rows(agent_pos) - agent_pos[:, None, :]
+        return np.concatenate([world.p_vel[world.agent_indices], agent_pos, entity_pos.reshape(n, -1),
+                               other_pos.reshape(n, -1)], axis=1)
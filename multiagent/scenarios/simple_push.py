@@ -1,6 +1,6 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, other_rows
 import random
 
 #
@@ -11,6 +11,8 @@ import random
 class Scenario(BaseScenario):
     def make_world(self):
         world = World()
+        # goals and colors chosen at reset are part of the state saved by world.get_state
+        world.state_attributes = ['goal_a', 'color']
         # set any world properties first
         world.dim_c = 2
         num_agents = 2
@@ -81,7 +83,7 @@ class Scenario(BaseScenario):
         #neg_rew = sum([np.sqrt(np.sum(np.square(a.state.p_pos - agent.state.p_pos))) for a in world.good_agents])
         return pos_rew - neg_rew
                
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
         for entity in world.landmarks:  # world.entities:
@@ -98,7 +100,33 @@ class Scenario(BaseScenario):
             comm.append(other.state.c)
             other_pos.append(other.state.p_pos - agent.state.p_pos)
         if not agent.adversary:
-            return np.concatenate([agent.state.p_vel] + [agent.goal_a.state.p_pos - agent.state.p_pos] + [agent.color] + entity_pos + entity_color + other_pos)
+            return np.concatenate([agent.state.p_vel] + [agent.goal_a.state.p_pos - agent.state.p_pos] + [agent.color] + entity_pos + entity_color + other_pos, out=out)
         else:
             #other_pos = list(reversed(other_pos)) if random.uniform(0,1) > 0.5 else other_pos  # randomize position of other agents in adversary network
-            return np.concatenate([agent.state.p_vel] + entity_pos + other_pos)
+            return np.concatenate([agent.state.p_vel] + entity_pos + other_pos, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        agent_pos = world.p_pos[world.agent_indices]
+        adversary = np.array([agent.adversary for agent in world.agents], dtype=bool)
+        goal_dist = np.sqrt(np.sum(np.square(agent_pos - np.array([agent.goal_a.state.p_pos for agent in world.agents])),
+                                   axis=1))
+        # good agents get closer to the goal (see agent_reward), adversaries keep the nearest good agent
+        # away from it while getting closer themselves (see adversary_reward)
+        return np.where(adversary, np.min(goal_dist[~adversary]) - goal_dist, -goal_dist)
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        entity_pos = (world.p_pos[world.landmark_indices][None, :, :] - agent_pos[:, None, :]).reshape(n, -1)
+        other_pos = (other_rows(agent_pos) - agent_pos[:, None, :]).reshape(n, -1)
+        entity_color = np.concatenate([landmark.color for landmark in world.landmarks])
+        # relative positions are computed for all agents at once, observations differ by role
+        obs_n = []
+        for i, agent in enumerate(world.agents):
+            if agent.adversary:
+                obs_n.append(np.concatenate([agent.state.p_vel, entity_pos[i], other_pos[i]]))
+            else:
+                obs_n.append(np.concatenate([agent.state.p_vel, agent.goal_a.state.p_pos - agent_pos[i], agent.color,
+                                             entity_pos[i], entity_color, other_pos[i]]))
+        return obs_n
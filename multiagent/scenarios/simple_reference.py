@@ -1,10 +1,12 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, other_rows
 
 class Scenario(BaseScenario):
     def make_world(self):
         world = World()
+        # goals and colors chosen at reset are part of the state saved by world.get_state
+        world.state_attributes = ['goal_a', 'goal_b', 'color']
         # set any world properties first
         world.dim_c = 10        
         # add agents
@@ -59,7 +61,7 @@ class Scenario(BaseScenario):
         dist2 = np.sum(np.square(agent.goal_a.state.p_pos - agent.goal_b.state.p_pos))
         return -dist2 #np.exp(-dist2)
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # goal positions
         # goal_pos = [np.zeros(world.dim_p), np.zeros(world.dim_p)]
         # if agent.goal_a is not None:
@@ -86,5 +88,21 @@ class Scenario(BaseScenario):
         for other in world.agents:
             if other is agent: continue
             comm.append(other.state.c)
-        return np.concatenate([agent.state.p_vel] + entity_pos + [goal_color[1]] + comm)
-            
\ No newline at end of file
+        return np.concatenate([agent.state.p_vel] + entity_pos + [goal_color[1]] + comm, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        has_goals = np.array([agent.goal_a is not None and agent.goal_b is not None for agent in world.agents])
+        goal_delta = np.array([agent.goal_a.state.p_pos - agent.goal_b.state.p_pos if has_goal else np.zeros(world.dim_p)
+                               for agent, has_goal in zip(world.agents, has_goals)])
+        return np.where(has_goals, -np.sum(np.square(goal_delta), axis=1), 0.0)
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        entity_pos = world.p_pos[world.landmark_indices][None, :, :] - agent_pos[:, None, :]
+        goal_color = np.array([agent.goal_b.color if agent.goal_b is not None else np.zeros(world.dim_color)
+                               for agent in world.agents])
+        comm = other_rows(np.array([agent.state.c for agent in world.agents]).reshape(n, -1))
+        return np.concatenate([world.p_vel[world.agent_indices], entity_pos.reshape(n, -1), goal_color,
+                               comm.reshape(n, -1)], axis=1)
@@ -1,10 +1,12 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, merge_observations
 
 class Scenario(BaseScenario):
     def make_world(self):
         world = World()
+        # goals and colors chosen at reset are part of the state saved by world.get_state
+        world.state_attributes = ['goal_a', 'goal_b', 'color']
         # set any world properties first
         world.dim_c = 3
         num_landmarks = 3
@@ -65,7 +67,7 @@ class Scenario(BaseScenario):
         dist2 = np.sum(np.square(a.goal_a.state.p_pos - a.goal_b.state.p_pos))
         return -dist2
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # goal color
         goal_color = np.zeros(world.dim_color)
         if agent.goal_b is not None:
@@ -84,8 +86,28 @@ class Scenario(BaseScenario):
         
         # speaker
         if not agent.movable:
-            return np.concatenate([goal_color])
+            return np.concatenate([goal_color], out=out)
         # listener
         if agent.silent:
-            return np.concatenate([agent.state.p_vel] + entity_pos + comm)
-            
+            return np.concatenate([agent.state.p_vel] + entity_pos + comm, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        # every agent gets the reward of the listener
+        a = world.agents[0]
+        return np.full(len(world.agents), -np.sum(np.square(a.goal_a.state.p_pos - a.goal_b.state.p_pos)))
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        speakers = np.flatnonzero([not agent.movable for agent in world.agents])
+        listeners = np.flatnonzero([agent.movable and agent.silent for agent in world.agents])
+        speaker_obs = np.array([world.agents[i].goal_b.color if world.agents[i].goal_b is not None
+                                else np.zeros(world.dim_color) for i in speakers]).reshape(len(speakers), -1)
+        entity_pos = world.p_pos[world.landmark_indices][None, :, :] - agent_pos[listeners][:, None, :]
+        comm = [np.concatenate([other.state.c for j, other in enumerate(world.agents)
+                                if j != i and other.state.c is not None]) for i in listeners]
+        listener_obs = np.concatenate([world.p_vel[world.agent_indices][listeners],
+                                       entity_pos.reshape(len(listeners), -1),
+                                       np.array(comm).reshape(len(listeners), -1)], axis=1)
+        return merge_observations(n, [(speakers, speaker_obs), (listeners, listener_obs)])
@@ -1,6 +1,6 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, pairwise_distances, other_rows, step_cached
 
 
 class Scenario(BaseScenario):
@@ -56,12 +56,14 @@ class Scenario(BaseScenario):
                 occupied_landmarks += 1
         if agent.collide:
             for a in world.agents:
-                if self.is_collision(a, agent):
+                # overlapping agents from the world's contact list (the agent always overlaps itself)
+                if a is agent or world.in_contact(a, agent):
                     rew -= 1
                     collisions += 1
         return (rew, collisions, min_dists, occupied_landmarks)
 
 
+    @step_cached
     def is_collision(self, agent1, agent2):
         delta_pos = agent1.state.p_pos - agent2.state.p_pos
         dist = np.sqrt(np.sum(np.square(delta_pos)))
@@ -80,7 +82,7 @@ class Scenario(BaseScenario):
                     rew -= 1
         return rew
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
         for entity in world.landmarks:  # world.entities:
@@ -96,4 +98,25 @@ class Scenario(BaseScenario):
             if other is agent: continue
             comm.append(other.state.c)
             other_pos.append(other.state.p_pos - agent.state.p_pos)
-        return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + comm)
+        return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + comm, out=out)
+
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        agent_pos = world.p_pos[world.agent_indices]
+        landmark_pos = world.p_pos[world.landmark_indices]
+        rew = np.full(len(agent_pos), -np.sum(np.min(pairwise_distances(agent_pos, landmark_pos), axis=0)))
+        # collisions with all agents from the world's contact list, plus the agent itself (as in reward)
+        agents = world.agent_indices
+        size = world.entity_size[agents]
+        collisions = np.sum(world.contact_adjacency()[np.ix_(agents, agents)], axis=1) + (size > 0)
+        collide = np.array([agent.collide for agent in world.agents], dtype=bool)
+        return rew - np.where(collide, collisions, 0)
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        entity_pos = world.p_pos[world.landmark_indices][None, :, :] - agent_pos[:, None, :]
+        other_pos = other_rows(agent_pos) - agent_pos[:, None, :]
+        comm = other_rows(np.array([agent.state.c for agent in world.agents]).reshape(n, -1))
+        return np.concatenate([world.p_vel[world.agent_indices], agent_pos, entity_pos.reshape(n, -1),
+                               other_pos.reshape(n, -1), comm.reshape(n, -1)], axis=1)
@@ -1,6 +1,6 @@
 import numpy as np
 from multiagent.core import World, Agent, Landmark
-from multiagent.scenario import BaseScenario
+from multiagent.scenario import BaseScenario, pairwise_distances, other_rows, merge_observations, step_cached
 
 
 class Scenario(BaseScenario):
@@ -116,13 +116,14 @@ class Scenario(BaseScenario):
         if agent.adversary:
             collisions = 0
             for a in self.good_agents(world):
-                if self.is_collision(a, agent):
+                if world.in_contact(a, agent):
                     collisions += 1
             return collisions
         else:
             return 0
 
 
+    @step_cached
     def is_collision(self, agent1, agent2):
         delta_pos = agent1.state.p_pos - agent2.state.p_pos
         dist = np.sqrt(np.sum(np.square(delta_pos)))
@@ -131,10 +132,12 @@ class Scenario(BaseScenario):
 
 
     # return all agents that are not adversaries
+    @step_cached
     def good_agents(self, world):
         return [agent for agent in world.agents if not agent.adversary]
 
     # return all adversarial agents
+    @step_cached
     def adversaries(self, world):
         return [agent for agent in world.agents if agent.adversary]
 
@@ -223,7 +226,7 @@ class Scenario(BaseScenario):
                 other_vel.append(other.state.p_vel)
         return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel)
 
-    def observation(self, agent, world):
+    def observation(self, agent, world, out=None):
         # get positions of all entities in this agent's reference frame
         entity_pos = []
         for entity in world.landmarks:  # world.entities:
@@ -300,12 +303,70 @@ class Scenario(BaseScenario):
         """
         if agent.adversary and not agent.leader:
             #print(np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel + [in_forest] + comm).shape)
-            return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel + in_forest + comm)
+            return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel + in_forest + comm, out=out)
         if agent.leader:
             return np.concatenate(
-                [agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel + in_forest + comm)
+                [agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + other_vel + in_forest + comm, out=out)
         else:
             #print(np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + [in_forest] + other_vel).shape)
-            return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + in_forest + other_vel)
+            return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos + in_forest + other_vel, out=out)
         #"""
 
+    # vectorized reward / observation of all agents
+    def reward_all(self, world):
+        agent_pos = world.p_pos[world.agent_indices]
+        size = world.entity_size[world.agent_indices]
+        adversary = np.array([agent.adversary for agent in world.agents], dtype=bool)
+        collide = np.array([agent.collide for agent in world.agents], dtype=bool)
+        # distances and collisions between good agents (rows) and adversaries (columns)
+        dist = pairwise_distances(agent_pos[~adversary], agent_pos[adversary])
+        collisions = dist < size[~adversary][:, None] + size[adversary][None, :]
+        rew = np.zeros(len(agent_pos))
+        # good agents (see agent_reward)
+        good_pos = agent_pos[~adversary]
+        x = np.abs(good_pos)
+        bound = np.where(x < 0.9, 0, np.where(x < 1.0, (x - 0.9) * 10, np.minimum(np.exp(2 * x - 2), 10)))
+        food_pos = np.array([food.state.p_pos for food in world.food])
+        food_size = np.array([food.size for food in world.food])
+        food_dist = pairwise_distances(good_pos, food_pos)
+        food_collisions = food_dist < size[~adversary][:, None] + food_size[None, :]
+        rew[~adversary] = (-5 * np.sum(collisions, axis=1) * collide[~adversary] - 2 * np.sum(bound, axis=1) +
+                           2 * np.sum(food_collisions, axis=1) + 0.05 * np.min(food_dist, axis=1))
+        # adversaries (see adversary_reward)
+        rew[adversary] = -0.1 * np.min(dist, axis=0) + 5 * np.sum(collisions) * collide[adversary]
+        return rew
+
+    def observation_all(self, world):
+        n = len(world.agents)
+        agent_pos = world.p_pos[world.agent_indices]
+        agent_vel = world.p_vel[world.agent_indices]
+        size = world.entity_size[world.agent_indices]
+        adversaries = np.flatnonzero([agent.adversary for agent in world.agents])
+        good_agents = np.flatnonzero([not agent.adversary for agent in world.agents])
+        leader = np.array([agent.leader for agent in world.agents], dtype=bool)
+        landmarks = [i for i, landmark in zip(world.landmark_indices, world.landmarks) if not landmark.boundary]
+        entity_pos = (world.p_pos[landmarks][None, :, :] - agent_pos[:, None, :]).reshape(n, -1)
+        # forests the agents are in
+        forest_pos = np.array([forest.state.p_pos for forest in world.forests])
+        forest_size = np.array([forest.size for forest in world.forests])
+        in_forest = pairwise_distances(agent_pos, forest_pos) < size[:, None] + forest_size[None, :]
+        inf1, inf2 = in_forest[:, 0], in_forest[:, 1]
+        outside = ~inf1 & ~inf2
+        # other agents are seen when in the same forest or both outside of the forests, always by the leader
+        visible = ((inf1[:, None] & inf1[None, :]) | (inf2[:, None] & inf2[None, :]) |
+                   (outside[:, None] & outside[None, :]) | leader[:, None])
+        visible = visible[~np.eye(n, dtype=bool)].reshape(n, n - 1, 1)
+        other_pos = np.where(visible, other_rows(agent_pos) - agent_pos[:, None, :], 0.0)
+        other_vel = np.where(visible, other_rows(agent_vel), 0.0)
+        # velocities are only observed for the other good agents
+        other_good = other_rows(np.array([not agent.adversary for agent in world.agents], dtype=bool))
+        forest_obs = np.where(in_forest, 1, -1)
+        obs = np.concatenate([agent_vel, agent_pos, entity_pos, other_pos.reshape(n, -1)], axis=1)
+        comm = np.tile(world.agents[0].state.c, (len(adversaries), 1))
+        adversary_obs = np.concatenate([obs[adversaries],
+                                        other_vel[adversaries][other_good[adversaries]].reshape(len(adversaries), -1),
+                                        forest_obs[adversaries], comm], axis=1)
+        good_obs = np.concatenate([obs[good_agents], forest_obs[good_agents],
+                                   other_vel[good_agents][other_good[good_agents]].reshape(len(good_agents), -1)],
+                                  axis=1)
+        return merge_observations(n, [(adversaries, adversary_obs), (good_agents, good_obs)])